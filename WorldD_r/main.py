@@ -6,6 +6,7 @@ import sys
 import tomllib
 
 # from tkinter import filedialog
+from types import MappingProxyType
 from typing import TypeVar, Union
 import pygame as pg
 from pygame.locals import *
@@ -112,6 +113,41 @@ def load(
             return None
 
 
+_load_cache: dict[tuple[str, object], tuple[int, int, tuple]] = {}
+
+
+def cached_load(path: str, spec_version=None, print_out: bool = False) -> Union[tuple[tuple, str, TILES, GRID, tuple], None]:
+    """
+    same as load, but every file is parsed only once while it stays unchanged on the disk.
+    the returned data is shared between callers, so it is made read-only (grid layers and tiles are mapping proxies).
+    :param path: str, path to file
+    :param print_out: boolean value, if False: no printing.
+    :param spec_version: specify version, if None then it will automatically match.
+    :returns: tile size, sprite sheet path, tiles, grid, layer names
+    """
+    key = (os.path.abspath(path), spec_version)
+    stat = os.stat(key[0])
+    if key in _load_cache:
+        mtime, size, data = _load_cache[key]
+        if mtime == stat.st_mtime_ns and size == stat.st_size:
+            return data
+    with open(key[0], "rb") as file:
+        data = load(file, spec_version, print_out)
+    if data is not None:
+        tile_size, sprite_sheet, tiles, grid, layer_names = data
+        for tile_group in tiles.values():
+            tile_group.tiles = MappingProxyType({name: tuple(pos) for name, pos in tile_group.tiles.items()})
+        data = (
+            tuple(tile_size),
+            sprite_sheet,
+            MappingProxyType(tiles),
+            tuple(MappingProxyType({pos: tuple(tile) for pos, tile in layer.items()}) for layer in grid),
+            tuple(layer_names),
+        )
+    _load_cache[key] = (stat.st_mtime_ns, stat.st_size, data)
+    return data
+
+
 def draw_rect(surf, color, rect, width=0, *args):
     """custom function to draw rect with negative size"""
     new_rect = pg.Rect(
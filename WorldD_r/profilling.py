@@ -1,4 +1,6 @@
-import cProfile
-from .main import Main
+import sys
 
-cProfile.run("Main().run()", sort="tottime")
+from profiling import main
+
+# kept for `python -m WorldD_r.profilling`, see profiling.py in the root of the repository
+main(["editor", *sys.argv[1:]])
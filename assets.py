@@ -0,0 +1,144 @@
+"""
+asset preloading on a thread pool.
+
+images, fonts, sounds and world files are read and decoded by worker threads (the pygame decoders and the file reads
+release the GIL), while the main thread draws the loading stage. everything touching the display (convert) or
+creating objects bound to the main thread (fonts) is done when the asset is requested, so callers get ready-to-use
+objects.
+
+the browser build (pygbag) has no threads, there the assets are loaded one by one on the main thread while waiting,
+and async_wait() gives the event loop a turn after every asset, so the loading stage is still drawn.
+"""
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pygame
+
+import WorldD_r.main as WorldD
+
+
+def _read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+LOADERS = {
+    "image": pygame.image.load,
+    "file": _read,
+    "sound": pygame.mixer.Sound,
+    "world": WorldD.cached_load,
+}
+
+
+class Assets:
+    def __init__(self, workers=4):
+        """
+        :param workers: size of the thread pool
+        """
+        self.pool = None if sys.platform == "emscripten" else ThreadPoolExecutor(workers, thread_name_prefix="assets")
+        self.futures = {}
+        # assets loaded on the main thread while waiting, when threads can't be started
+        self.pending = []
+        # converted images, key: (path, alpha)
+        self.images = {}
+
+    def preload(self, kind, path):
+        """
+        starts loading the asset in the background.
+        :param kind: "image", "file", "sound" or "world"
+        :param path: path to the asset
+        """
+        key = (kind, path)
+        if key in self.futures:
+            return
+        if self.pool is not None:
+            try:
+                self.futures[key] = self.pool.submit(LOADERS[kind], path)
+                return
+            except RuntimeError:
+                # can't start new thread
+                self.pool = None
+        self.futures[key] = Future()
+        self.pending.append(key)
+
+    def load_pending(self, key=None):
+        """
+        loads an asset waiting for the main thread.
+        :param key: (kind, path) of the asset, if None then the first one waiting
+        :return: False if there was nothing to load
+        """
+        if key is None:
+            if not self.pending:
+                return False
+            key = self.pending[0]
+        elif key not in self.pending:
+            return False
+        self.pending.remove(key)
+        kind, path = key
+        try:
+            self.futures[key].set_result(LOADERS[kind](path))
+        except Exception as error:
+            self.futures[key].set_exception(error)
+        return True
+
+    @property
+    def progress(self):
+        """:return: loaded part of the preloaded assets (0 - 1)"""
+        if not self.futures:
+            return 1.0
+        return sum(future.done() for future in self.futures.values()) / len(self.futures)
+
+    def wait(self, on_progress=None, interval=1 / 60):
+        """
+        waits until every preloaded asset is loaded.
+        :param on_progress: called with the progress every interval while waiting (loading stage)
+        :param interval: time between two calls of on_progress [ s ]
+        """
+        while (progress := self.progress) < 1:
+            if on_progress is not None:
+                on_progress(progress)
+            if not self.load_pending():
+                time.sleep(interval)
+        self.finish(on_progress)
+
+    async def async_wait(self, on_progress=None, interval=1 / 60):
+        """wait() without blocking the event loop (browser)"""
+        while (progress := self.progress) < 1:
+            if on_progress is not None:
+                on_progress(progress)
+            await asyncio.sleep(0 if self.load_pending() else interval)
+        self.finish(on_progress)
+
+    def finish(self, on_progress=None):
+        if on_progress is not None:
+            on_progress(1.0)
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+    def get(self, kind, path):
+        """:return: loaded asset, loaded right away if it wasn't preloaded"""
+        future = self.futures.get((kind, path))
+        if future is None:
+            return LOADERS[kind](path)
+        self.load_pending((kind, path))
+        return future.result()
+
+    def image(self, path, alpha=True):
+        """:return: image converted to the format of the display"""
+        key = (path, alpha)
+        if key not in self.images:
+            image = self.get("image", path)
+            self.images[key] = image.convert_alpha() if alpha else image.convert()
+        return self.images[key]
+
+    def font(self, path, size):
+        return pygame.font.Font(io.BytesIO(self.get("file", path)), size)
+
+    def sound(self, path):
+        return self.get("sound", path)
+
+    def world(self, path):
+        return self.get("world", path)
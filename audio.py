@@ -0,0 +1,164 @@
+"""
+audio of the game.
+
+background music is streamed with pygame.mixer.music: the track is decoded a bit at a time while it plays, so
+it takes no memory and no loading time no matter how long it is. switching tracks fades the old one out and then the
+new one in, driven by the end event of the mixer instead of checking the channel every frame. it is not a crossfade:
+the mixer streams a single music track, and playing the old one on a Channel would mean decoding it whole again.
+
+sound effects are decoded (or synthesized) at startup in the format of the mixer and played on a fixed pool of
+voices. when every voice is busy, a new effect steals the voice of the least important (and oldest) effect.
+"""
+import os
+import random
+from array import array
+
+import pygame
+
+# sound effects, play them with Effects.play(MOVE) etc.
+MOVE, HIT, DEATH, LEVEL_COMPLETE = range(4)
+EFFECTS = ("move", "hit", "death", "level-complete")
+# effects with a higher priority steal voices of the ones with a lower priority
+PRIORITIES = (0, 1, 3, 2)
+# the same effect started again within this time is skipped (many entities at once) [ ms ]
+MIN_INTERVAL = 30
+# effects used when there is no sounds/<name>.wav or .ogg: (start frequency, end frequency, seconds, noise) segments
+SYNTH = {
+    "move": ((520, 780, 0.05, 0.0),),
+    "hit": ((220, 90, 0.12, 0.6),),
+    "death": ((440, 110, 0.45, 0.1),),
+    "level-complete": ((523, 523, 0.08, 0.0), (659, 659, 0.08, 0.0), (784, 784, 0.16, 0.0)),
+}
+# mixer sample size -> array type code, amplitude, zero level
+SAMPLE_FORMATS = {8: ("B", 127, 128), -8: ("b", 127, 0), 16: ("H", 32767, 32768), -16: ("h", 32767, 0), 32: ("f", 1, 0)}
+
+
+class Music:
+    def __init__(self, volume=0.3, fade_ms=1000):
+        """
+        :param volume: volume of the music (0 - 1)
+        :param fade_ms: length of the fade out and the fade in [ ms ]
+        """
+        self.volume = volume
+        self.fade_ms = fade_ms
+        # track which is playing (or fading out) and the one which should play
+        self.track = None
+        self.wanted = None
+        self.end_event = pygame.event.custom_type()
+        pygame.mixer.music.set_endevent(self.end_event)
+
+    def play(self, path):
+        """
+        fades the current track out and then the new one in (one after the other, not a crossfade), it loops until
+        another track is played.
+        :param path: path to the track, None fades to silence
+        """
+        if path == self.wanted:
+            return
+        self.wanted = path
+        if self.track is None:
+            self.start()
+        else:
+            # the wanted track starts when the end event of the fade out comes
+            pygame.mixer.music.fadeout(self.fade_ms)
+
+    def start(self):
+        self.track = self.wanted
+        if self.track is None:
+            return
+        pygame.mixer.music.load(self.track)
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.play(-1, fade_ms=self.fade_ms)
+
+    def handle_event(self, event):
+        """:return: True if the event belonged to the music"""
+        if event.type != self.end_event:
+            return False
+        self.track = None
+        self.start()
+        return True
+
+
+def effect_path(name):
+    """:return: path to the sound file of the effect, None if there is none"""
+    for extension in (".wav", ".ogg"):
+        if os.path.exists(f"sounds/{name}{extension}"):
+            return f"sounds/{name}{extension}"
+    return None
+
+
+def synthesize(segments, volume=0.6):
+    """
+    square wave sweeps with a decaying envelope, created right in the format of the mixer.
+    :param segments: (start frequency, end frequency, seconds, noise) of every part of the sound
+    :param volume: volume of the sound (0 - 1)
+    :rtype: pygame.mixer.Sound
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    typecode, amplitude, zero = SAMPLE_FORMATS[size]
+    samples = array(typecode)
+    noise_generator = random.Random(0)
+    phase = 0.0
+    for start, end, seconds, noise in segments:
+        count = int(frequency * seconds)
+        for idx in range(count):
+            progress = idx / count
+            phase += (start + (end - start) * progress) / frequency
+            value = (1 if phase % 1 < 0.5 else -1) * (1 - noise) + noise_generator.uniform(-1, 1) * noise
+            sample = value * volume * (1 - progress) * amplitude + zero
+            samples.extend([sample if typecode == "f" else round(sample)] * channels)
+    return pygame.mixer.Sound(buffer=samples)
+
+
+class Effects:
+    def __init__(self, assets=None, voices=8, volume=0.5):
+        """
+        :param assets: assets.Assets the sound files are taken from (preloaded), if None then they are loaded here
+        :param voices: amount of effects playing at once
+        :param volume: volume of the effects (0 - 1)
+        """
+        pygame.mixer.set_num_channels(voices)
+        self.voices = tuple(pygame.mixer.Channel(idx) for idx in range(voices))
+        # priority and start of the effect playing on every voice
+        self.priorities = [0] * voices
+        self.started = [0] * voices
+        self.last_start = [-MIN_INTERVAL] * len(EFFECTS)
+        self.sounds = tuple(self.load(name, assets) for name in EFFECTS)
+        for sound in self.sounds:
+            sound.set_volume(volume)
+
+    @staticmethod
+    def load(name, assets=None):
+        path = effect_path(name)
+        if path is None:
+            return synthesize(SYNTH[name])
+        return pygame.mixer.Sound(path) if assets is None else assets.sound(path)
+
+    def play(self, effect):
+        """
+        :param effect: MOVE, HIT, DEATH or LEVEL_COMPLETE
+        :return: True if the effect plays
+        """
+        now = pygame.time.get_ticks()
+        if now - self.last_start[effect] < MIN_INTERVAL:
+            return False
+        priority = PRIORITIES[effect]
+        voice = -1
+        for idx in range(len(self.voices)):
+            if not self.voices[idx].get_busy():
+                voice = idx
+                break
+            if (
+                voice < 0
+                or self.priorities[idx] < self.priorities[voice]
+                or self.priorities[idx] == self.priorities[voice]
+                and self.started[idx] < self.started[voice]
+            ):
+                voice = idx
+        if self.voices[voice].get_busy() and self.priorities[voice] > priority:
+            return False
+        self.voices[voice].play(self.sounds[effect])
+        self.priorities[voice] = priority
+        self.started[voice] = now
+        self.last_start[effect] = now
+        return True
@@ -0,0 +1,215 @@
+"""
+headless benchmark of the game loop, level by level.
+
+the game runs without a window (SDL dummy drivers) and not limited by the FPS. every level gets a warmup and then
+a fixed amount of frames of render() + update() with scripted moves: the player steps away and back again, so the
+entities move and collide like in a real game. the next move is sent as soon as the player finished the move
+animation, so the same moves are played no matter how the frames are paced. the results are json, they can be saved
+as a baseline and later runs are compared against it.
+
+usage: python benchmark.py [--frames N] [--levels 0 3 ...] [--pack PATH] [--dirty-rects] [--output PATH]
+                           [--save-baseline PATH] [--baseline PATH] [--threshold 0.1]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# every move is followed by its opposite, so the player stays next to the spawn
+SCRIPT = ("DOWN", "UP", "RIGHT", "LEFT", "DOWN", "RIGHT", "LEFT", "UP")
+FRAME_DT = 1 / 60
+# metric -> 1 if higher is better, -1 if lower is better
+METRICS = {"fps": 1, "frame_ms_p95": -1, "alloc_kib_per_frame": -1, "peak_memory_kib": -1}
+
+
+def warp(game, level):
+    """starts the level from the beginning, without any fading"""
+    game.cur_world_id = level
+    game.death_screen.alpha = game.death_screen.dst_alpha = 0
+    game.too_much_moves.alpha = game.too_much_moves.dst_alpha = 0
+    game.display_alpha = game.dst_display_alpha = 255
+    game.start_world()
+
+
+def run_frames(game, level, frames, on_frame=None):
+    """
+    runs the game loop with the scripted moves.
+    :param game: instance of main.Main
+    :param level: index of the level, the game is warped back to it when the player finishes, dies or runs out of moves
+    :param frames: amount of frames
+    :param on_frame: called after every frame
+    :return: amount of sent moves, amount of moves the game accepted
+    """
+    import pygame
+
+    keys = [getattr(pygame, f"K_{name}") for name in SCRIPT]
+    sent = accepted = 0
+    warp(game, level)
+    for _ in range(frames):
+        # the state of the level is replaced only by a move the game accepted
+        state = None
+        if game.player.ready_for_next_move:
+            if game.cur_world_id != level or game.player.health <= 0 or game.too_much_moves.dst_alpha:
+                warp(game, level)
+            else:
+                pygame.event.post(pygame.event.Event(pygame.KEYUP, key=keys[sent % len(keys)]))
+                sent += 1
+                state = game.current_world.state
+        game.render()
+        game.update()
+        game.dt = FRAME_DT
+        accepted += state is not None and game.current_world.state is not state
+        if on_frame is not None:
+            on_frame()
+    return sent, accepted
+
+
+def cache_stats(cache, hits, misses):
+    """
+    :param cache: main.texture_cache or main.text_cache
+    :param hits: hits of the cache before the measuring
+    :param misses: misses of the cache before the measuring
+    :return: hits, misses and hit rate of the cache during the measuring
+    """
+    hits = cache.hits - hits
+    misses = cache.misses - misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+
+
+def bench_level(game, level, frames, warmup):
+    """
+    :return: results of the level, the timing and the memory are measured in separate runs (tracemalloc is slow)
+    """
+    import main
+
+    run_frames(game, level, warmup)
+    texture_counts = main.texture_cache.hits, main.texture_cache.misses
+    text_counts = main.text_cache.hits, main.text_cache.misses
+
+    times = []
+    last = time.perf_counter()
+
+    def lap():
+        nonlocal last
+        now = time.perf_counter()
+        times.append(now - last)
+        last = now
+
+    started = last
+    moves, accepted_moves = run_frames(game, level, frames, lap)
+    seconds = time.perf_counter() - started
+    textures = cache_stats(main.texture_cache, *texture_counts)
+    text = cache_stats(main.text_cache, *text_counts)
+
+    allocated = []
+    tracemalloc.start()
+
+    def measure():
+        current, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - current)
+        tracemalloc.reset_peak()
+
+    run_frames(game, level, frames, measure)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        "level": level,
+        "frames": frames,
+        "moves": moves,
+        "accepted_moves": accepted_moves,
+        "seconds": seconds,
+        "fps": frames / seconds if seconds else 0.0,
+        "frame_ms_p50": times[len(times) // 2] * 1000,
+        "frame_ms_p95": times[round((len(times) - 1) * 0.95)] * 1000,
+        # memory allocated (and released again) during a frame
+        "alloc_kib_per_frame": sum(allocated) / len(allocated) / 1024,
+        "peak_memory_kib": peak_memory / 1024,
+        # lookups of the measured frames (the warmup filled the caches)
+        "texture_cache": textures,
+        "text_cache": text,
+    }
+
+
+def run(frames=600, warmup=60, levels=None, level_pack=None, dirty_rects=False, seed=0):
+    """
+    :param frames: measured frames of every level
+    :param warmup: frames before the measuring (textures, caches)
+    :param levels: indexes of the levels, if None then all of them
+    :param level_pack: path to a level pack, if None then the levels defined in main.py
+    :param dirty_rects: run the game with dirty rects
+    :param seed: seed of the storms
+    :return: results of the benchmark
+    :rtype: dict
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import main
+
+    game = main.Main(level_pack, dirty_rects=dirty_rects, seed=seed)
+    if levels is None:
+        levels = range(len(game.worlds))
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "frames": frames,
+        "dirty_rects": dirty_rects,
+        "levels": [bench_level(game, level, frames, warmup) for level in levels],
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    :param results: results of run()
+    :param baseline: results of an earlier run()
+    :param threshold: allowed relative change to the worse, 0.1 = 10%
+    :return: list of regressions (level, metric, baseline value, new value)
+    """
+    old_levels = {level["level"]: level for level in baseline["levels"]}
+    regressions = []
+    for level in results["levels"]:
+        old = old_levels.get(level["level"])
+        if old is None:
+            continue
+        for metric, sign in METRICS.items():
+            if not old[metric]:
+                continue
+            change = (level[metric] - old[metric]) / old[metric] * sign
+            if change < -threshold:
+                regressions.append((level["level"], metric, old[metric], level[metric]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="headless benchmark of the game loop, level by level")
+    parser.add_argument("--frames", type=int, default=600, help="measured frames of every level")
+    parser.add_argument("--warmup", type=int, default=60, help="frames before the measuring")
+    parser.add_argument("--levels", type=int, nargs="*", default=None, help="indexes of the levels (default: all)")
+    parser.add_argument("--pack", default=None, help="benchmark levels from a level pack")
+    parser.add_argument("--dirty-rects", action="store_true", help="run the game with dirty rects")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the storms")
+    parser.add_argument("--output", default=None, help="write the results to a file instead of stdout")
+    parser.add_argument("--save-baseline", default=None, help="save the results as a baseline")
+    parser.add_argument("--baseline", default=None, help="compare the results with a baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative regression (default: 0.1)")
+    args = parser.parse_args()
+
+    results = run(args.frames, args.warmup, args.levels, args.pack, args.dirty_rects, args.seed)
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for level, metric, old, new in regressions:
+            print(f"regression: level {level + 1} {metric} {old:.2f} -> {new:.2f}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,170 @@
+"""
+headless turn engine, the rules of the game without pygame.
+
+the whole game state is immutable and made of integer grid cells, so a turn is just step(board, state, move) -> state.
+the game (main.py) only renders the state, but solvers, replays and tests can run it without a window.
+"""
+from dataclasses import dataclass, replace
+
+SHARK = "shark"
+STORM = "storm"
+FOG = "fog"
+
+# moves of the player (same as the arrow keys in the game)
+LEFT = (-1, 1)
+RIGHT = (1, -1)
+UP = (0, -1)
+DOWN = (0, 1)
+MOVES = (LEFT, RIGHT, UP, DOWN)
+
+# directions a storm can knock the player to
+KNOCKBACKS = ((-1, 0), (1, 0), (0, 1), (0, -1))
+
+_RNG_MASK = (1 << 64) - 1
+
+
+@dataclass(frozen=True)
+class EntityState:
+    kind: str
+    cell: tuple[int, int]
+    direction: tuple[int, int] = (0, 0)
+    can_attack: bool = False
+    # cell before the last move, used to find sharks which swapped places with the player
+    last_cell: tuple[int, int] | None = None
+
+
+@dataclass(frozen=True)
+class Board:
+    """static part of a level"""
+
+    walkable: frozenset[tuple[int, int]]
+    end: frozenset[tuple[int, int]]
+    max_move_count: int
+    entities: tuple[EntityState, ...]
+    start: tuple[int, int] = (0, 0)
+    max_health: int = 2
+
+
+@dataclass(frozen=True)
+class State:
+    player: tuple[int, int]
+    health: int
+    move_count: int
+    entities: tuple[EntityState, ...]
+    # state of the random number generator (storm knockbacks)
+    rng: int
+    last_move: tuple[int, int] = (0, 0)
+
+
+def board_from_grid(layer, entities, max_move_count, **kwargs) -> Board:
+    """
+    :param layer: grid layer (position -> (tile group, tile name)), tiles named "end" finish the level
+    :param entities: initial states of the entities
+    :param max_move_count: maximum amount of moves
+    :return: board of the level
+    """
+    return Board(
+        frozenset(layer),
+        frozenset(pos for pos, (_, name) in layer.items() if name == "end"),
+        max_move_count,
+        tuple(entities),
+        **kwargs,
+    )
+
+
+def start(board: Board, seed: int = 0, health: int | None = None) -> State:
+    """
+    :param board: board of the level
+    :param seed: seed (or state) of the random number generator
+    :param health: health of the player, if None then the max health of the board
+    :return: state at the beginning of the level
+    """
+    return State(board.start, board.max_health if health is None else health, 0, board.entities, seed & _RNG_MASK)
+
+
+def next_random(rng: int) -> tuple[int, int]:
+    """
+    64-bit LCG, it is part of the state, so every turn can be replayed.
+    :return: new rng state, random 31-bit number
+    """
+    rng = (rng * 6364136223846793005 + 1442695040888963407) & _RNG_MASK
+    return rng, rng >> 33
+
+
+def is_dead(state: State) -> bool:
+    return state.health <= 0
+
+
+def is_finished(board: Board, state: State) -> bool:
+    """player reached the end of the level (no matter how many moves it took)"""
+    return not is_dead(state) and state.player in board.end
+
+
+def is_won(board: Board, state: State) -> bool:
+    return is_finished(board, state) and state.move_count <= board.max_move_count
+
+
+def step(board: Board, state: State, move: tuple[int, int]) -> State:
+    """
+    plays one turn.
+    :param board: board of the level
+    :param state: state before the turn
+    :param move: move of the player (one of MOVES)
+    :return: state after the turn, the same object if the move isn't possible
+    """
+    if is_dead(state) or state.player in board.end:
+        return state
+    player = (state.player[0] + move[0], state.player[1] + move[1])
+    if player not in board.walkable:
+        return state
+    health = state.health
+    rng = state.rng
+
+    # entities move after the player
+    entities = []
+    for entity in state.entities:
+        if entity.kind == SHARK:
+            direction = entity.direction
+            if (entity.cell[0] + direction[0], entity.cell[1] + direction[1]) not in board.walkable:
+                direction = (-direction[0], -direction[1])
+            cell = (entity.cell[0] + direction[0], entity.cell[1] + direction[1])
+            entity = EntityState(SHARK, cell, direction, True, entity.cell)
+        entities.append(entity)
+
+    occupancy: dict[tuple[int, int], list[int]] = {}
+    for idx, entity in enumerate(entities):
+        occupancy.setdefault(entity.cell, []).append(idx)
+
+    # collisions, knockbacks are checked again in the cell the player lands in
+    checked = set()
+    previous_cell = state.player
+    while health > 0 and player not in checked:
+        player_cell = player
+        checked.add(player_cell)
+        hits = list(occupancy.get(player_cell, ()))
+        if previous_cell is not None:
+            # sharks which swapped places with the player went through it
+            hits += [idx for idx in occupancy.get(previous_cell, ()) if entities[idx].last_cell == player_cell]
+            previous_cell = None
+        for idx in hits:
+            entity = entities[idx]
+            if entity.kind == SHARK:
+                if not entity.can_attack:
+                    continue
+                cell = (entity.cell[0] - entity.direction[0], entity.cell[1] - entity.direction[1])
+                occupancy[entity.cell].remove(idx)
+                occupancy.setdefault(cell, []).append(idx)
+                entities[idx] = replace(entity, cell=cell, can_attack=False)
+                health -= 1
+                player = (player[0] - move[0], player[1] - move[1])
+            elif entity.kind == STORM:
+                rng, value = next_random(rng)
+                knockback = KNOCKBACKS[value % len(KNOCKBACKS)]
+                health -= 1
+                player = (player[0] + knockback[0], player[1] + knockback[1])
+            elif entity.kind == FOG:
+                health = 0
+            if player != player_cell or health <= 0:
+                break
+
+    return State(player, health, state.move_count + 1, tuple(entities), rng, move)
@@ -0,0 +1,85 @@
+"""
+per-phase frame-time profiler.
+
+every frame is split into phases (world render, entities, outline, ...), the time of each phase is kept in a ring
+buffer of the last frames. the stats can be shown as an overlay (F3 in the game) and exported to csv or json.
+when it is disabled, the game only checks one attribute per phase.
+"""
+import csv
+import json
+from array import array
+from time import perf_counter
+
+PHASES = ("update", "world", "entities", "outline", "hud", "overlays", "scale", "flip", "tick")
+
+
+class FrameProfiler:
+    def __init__(self, size=600):
+        """
+        :param size: amount of frames kept in the ring buffer
+        """
+        self.enabled = False
+        self.size = size
+        self.samples = {phase: array("d", bytes(8 * size)) for phase in PHASES}
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.index = 0
+        self.count = 0
+        self.last = perf_counter()
+
+    def lap(self, phase=None):
+        """
+        adds the time since the last lap to the phase.
+        :param phase: name of the phase, if None then the time is not counted (start of measuring)
+        """
+        now = perf_counter()
+        if phase is not None:
+            self.current[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        """moves the times of the current frame (in ms) into the ring buffer"""
+        for phase, seconds in self.current.items():
+            self.samples[phase][self.index] = seconds * 1000
+            self.current[phase] = 0.0
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def frames(self):
+        """:return: frames in the ring buffer from the oldest one, every frame is a dict phase -> ms"""
+        start = (self.index - self.count) % self.size
+        return [
+            {phase: self.samples[phase][(start + idx) % self.size] for phase in PHASES} for idx in range(self.count)
+        ]
+
+    def stats(self):
+        """:return: phase -> (p50, p95, max) in ms, "total" is the whole frame"""
+        frames = self.frames()
+        if not frames:
+            return {}
+        columns = {phase: sorted(frame[phase] for frame in frames) for phase in PHASES}
+        columns["total"] = sorted(sum(frame.values()) for frame in frames)
+        last = len(frames) - 1
+        return {
+            phase: (values[last // 2], values[round(last * 0.95)], values[last]) for phase, values in columns.items()
+        }
+
+    def export(self, path):
+        """
+        :param path: .json for stats and frames, anything else for csv with a row per frame
+        """
+        if path.endswith(".json"):
+            with open(path, "w") as file:
+                json.dump(
+                    {
+                        "phases": PHASES,
+                        "stats": {phase: dict(zip(("p50", "p95", "max"), stat)) for phase, stat in self.stats().items()},
+                        "frames": self.frames(),
+                    },
+                    file,
+                    indent=2,
+                )
+        else:
+            with open(path, "w", newline="") as file:
+                writer = csv.DictWriter(file, PHASES)
+                writer.writeheader()
+                writer.writerows(self.frames())
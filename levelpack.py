@@ -0,0 +1,216 @@
+"""
+binary level-pack: every level (tile grid, entity spawns and max move count) in one file.
+
+layout (little-endian):
+    header      magic "TTSP", format version (u16), level count (u16)
+    offsets     level count + 1 absolute offsets (u32), the last one is the end of the file
+    level       max move count (u16), tile size (2 x u16)
+                palette: count (u8), then group (str), name (str), rect (4 x i16) for every tile
+                layers: count (u8), then name (str), left, top (2 x i16), width, height (2 x u16)
+                        and width * height tile ids (u8, 0 = empty, otherwise palette index + 1)
+                entities: count (u16), then type (u8), has direction (u8), x, y (2 x i16), direction (2 x i8)
+                music: path of the background music (str)
+
+strings are stored as their length (u8) followed by utf-8 bytes.
+"""
+import struct
+from dataclasses import dataclass
+from sys import argv
+
+import WorldD_r.main as WorldD
+
+MAGIC = b"TTSP"
+FORMAT_VERSION = 2
+ENTITY_TYPES = ("Shark", "Storm", "Fog")
+
+HEADER = struct.Struct("<4sHH")
+OFFSET = struct.Struct("<I")
+LEVEL = struct.Struct("<HHH")
+RECT = struct.Struct("<hhhh")
+LAYER = struct.Struct("<hhHH")
+COUNT = struct.Struct("<H")
+ENTITY = struct.Struct("<BBhhbb")
+
+
+@dataclass(frozen=True)
+class PackedLevelData:
+    """level read from a pack, world is in the same shape as WorldD.load returns it"""
+
+    world: tuple
+    entities: tuple[tuple[str, tuple[int, int], tuple[int, int] | None], ...]
+    max_move_count: int
+    music: str
+
+
+def _write_str(out: bytearray, text: str):
+    data = text.encode()
+    out.append(len(data))
+    out += data
+
+
+def _read_str(data: bytes, pos: int) -> tuple[str, int]:
+    length = data[pos]
+    return data[pos + 1 : pos + 1 + length].decode(), pos + 1 + length
+
+
+def encode_level(world, entities, max_move_count, music) -> bytes:
+    """
+    :param world: world data as returned by WorldD.load
+    :param entities: sequence of (type name, position, direction or None)
+    :param max_move_count: maximum amount of moves
+    :param music: path of the background music
+    :return: encoded level
+    """
+    tile_size, _, tiles, grid, layer_names = world
+    out = bytearray(LEVEL.pack(max_move_count, int(tile_size[0]), int(tile_size[1])))
+
+    palette = [(group, name, rect) for group, tile_group in tiles.items() for name, rect in tile_group.tiles.items()]
+    if len(palette) > 255:
+        raise ValueError(f"too many tiles for a level pack ({len(palette)} > 255)")
+    ids = {(group, name): idx + 1 for idx, (group, name, _) in enumerate(palette)}
+    out.append(len(palette))
+    for group, name, rect in palette:
+        _write_str(out, group)
+        _write_str(out, name)
+        out += RECT.pack(*map(int, rect))
+
+    out.append(len(grid))
+    for layer, layer_name in zip(grid, layer_names):
+        _write_str(out, layer_name)
+        if not layer:
+            out += LAYER.pack(0, 0, 0, 0)
+            continue
+        left, top = min(pos[0] for pos in layer), min(pos[1] for pos in layer)
+        width, height = max(pos[0] for pos in layer) - left + 1, max(pos[1] for pos in layer) - top + 1
+        out += LAYER.pack(left, top, width, height)
+        cells = bytearray(width * height)
+        for (x, y), (group, name) in layer.items():
+            cells[(y - top) * width + x - left] = ids[(group, name)]
+        out += cells
+
+    out += COUNT.pack(len(entities))
+    for entity_type, pos, direction in entities:
+        has_direction = direction is not None
+        direction = direction if has_direction else (0, 0)
+        out += ENTITY.pack(ENTITY_TYPES.index(entity_type), has_direction, *map(int, pos), *map(int, direction))
+    _write_str(out, music)
+    return bytes(out)
+
+
+def decode_level(data: bytes) -> PackedLevelData:
+    """
+    :param data: encoded level
+    :return: decoded level
+    """
+    max_move_count, tile_w, tile_h = LEVEL.unpack_from(data, 0)
+    pos = LEVEL.size
+
+    tiles = {}
+    palette = [None]
+    palette_count = data[pos]
+    pos += 1
+    for _ in range(palette_count):
+        group, pos = _read_str(data, pos)
+        name, pos = _read_str(data, pos)
+        rect = RECT.unpack_from(data, pos)
+        pos += RECT.size
+        tiles.setdefault(group, {})[name] = rect
+        palette.append((group, name))
+
+    grid, layer_names = [], []
+    layer_count = data[pos]
+    pos += 1
+    for _ in range(layer_count):
+        layer_name, pos = _read_str(data, pos)
+        left, top, width, height = LAYER.unpack_from(data, pos)
+        pos += LAYER.size
+        cells = data[pos : pos + width * height]
+        pos += width * height
+        grid.append(
+            {(left + idx % width, top + idx // width): palette[tile_id] for idx, tile_id in enumerate(cells) if tile_id}
+        )
+        layer_names.append(layer_name)
+
+    entities = []
+    (entity_count,) = COUNT.unpack_from(data, pos)
+    pos += COUNT.size
+    for _ in range(entity_count):
+        entity_type, has_direction, x, y, dx, dy = ENTITY.unpack_from(data, pos)
+        pos += ENTITY.size
+        entities.append((ENTITY_TYPES[entity_type], (x, y), (dx, dy) if has_direction else None))
+    music, pos = _read_str(data, pos)
+
+    world = (
+        (tile_w, tile_h),
+        None,
+        {group: WorldD.PureTileGroup(group, group_tiles, (0, 0)) for group, group_tiles in tiles.items()},
+        grid,
+        layer_names,
+    )
+    return PackedLevelData(world, tuple(entities), max_move_count, music)
+
+
+class LevelPack:
+    """reads the header of a level pack once and seeks straight to the requested level"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            magic, version, count = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a level pack")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"unsupported level pack version {version} (expected {FORMAT_VERSION})")
+            self.offsets = [OFFSET.unpack(file.read(OFFSET.size))[0] for _ in range(count + 1)]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read(self, idx) -> PackedLevelData:
+        """
+        :param idx: index of the level
+        :return: decoded level
+        """
+        if not 0 <= idx < len(self):
+            raise IndexError("level index out of range")
+        with open(self.path, "rb") as file:
+            file.seek(self.offsets[idx])
+            return decode_level(file.read(self.offsets[idx + 1] - self.offsets[idx]))
+
+
+def write_pack(path, levels):
+    """
+    :param path: destination path
+    :param levels: sequence of encoded levels (see encode_level)
+    """
+    start = HEADER.size + OFFSET.size * (len(levels) + 1)
+    offsets = [start]
+    for level in levels:
+        offsets.append(offsets[-1] + len(level))
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(levels)))
+        file.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        file.write(b"".join(levels))
+
+
+def export(path, levels=None):
+    """
+    builds a level pack out of the level definitions of the game.
+    :param path: destination path
+    :param levels: sequence of main.Level, if None then main.LEVELS
+    """
+    import main
+
+    if levels is None:
+        levels = main.LEVELS
+    encoded = []
+    for level in levels:
+        entities = [
+            (entity.__name__, tuple(args[0]), tuple(args[1]) if len(args) > 1 else None) for entity, *args in level.entities
+        ]
+        encoded.append(encode_level(WorldD.cached_load(level.world_path), entities, level.max_move_count, level.music))
+    write_pack(path, encoded)
+
+
+if __name__ == "__main__":
+    export(argv[1] if len(argv) > 1 else "levels.pack")
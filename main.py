@@ -6,10 +6,23 @@
 # ///
 import math
 import random
+import re
+from bisect import bisect_left, insort
 from sys import exit, argv
 import pygame
 
+# WorldD_r.main calls pygame.init(), the mixer takes these settings only before that
+# (a small buffer, so the effects start within a frame)
+pygame.mixer.pre_init(channels=1, buffer=512)
+
 import WorldD_r
+import assets
+import audio
+import engine
+import frametimes
+import levelpack
+import replay
+import scheduler
 
 try:
     import WorldD_r.main as WorldD
@@ -38,8 +51,17 @@ except Exception as e:
 
 
 import typing
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    # optional, the projection table is built in plain python without it
+    numpy = None
+from collections import OrderedDict
 from dataclasses import dataclass
 import asyncio
+import time
 
 
 # pygame.init()
@@ -84,22 +106,281 @@ def outline(img: pygame.Surface, color=(255, 255, 255), width=1, corners=(True,
     return new_img
 
 
+_silhouette_cache = weakref.WeakKeyDictionary()
+
+
+def silhouette(img: pygame.Surface, color=(255, 255, 255)):
+    """
+    outline of an image without the image itself (same as outline with width 1 and all corners), cached per image.
+    drawing silhouettes of every sprite first and then the sprites moved by (1, 1) gives the same result as outline
+    of the whole frame, but without building a mask of the frame every time.
+    :param img: image, it has to stay unchanged (textures from texture_cache, baked terrain)
+    :type img: pygame.Surface
+    :param color: color of the outline
+    :type color: Sequence[int | float]
+    :return: outline of the image, 2 pixels bigger than the image
+    :rtype: pygame.Surface
+    """
+    color = tuple(color)
+    cache = _silhouette_cache.setdefault(img, {})
+    if color not in cache:
+        cl = pygame.mask.from_surface(img).to_surface(setcolor=color, unsetcolor=(0, 0, 0, 0))
+        new_img = pygame.Surface((img.get_width() + 2, img.get_height() + 2), pygame.SRCALPHA)
+        new_img.fblits([(cl, (x, y)) for y in range(3) for x in range(3) if (x, y) != (1, 1)])
+        cache[color] = new_img
+    return cache[color]
+
+
+def interpolate(previous, current, alpha):
+    """
+    :return: position between the last two simulation steps
+    :rtype: pygame.Vector2
+    """
+    return current if alpha >= 1 else previous.lerp(current, alpha)
+
+
+def grid_cell(pos) -> tuple[int, int]:
+    """
+    :param pos: position on the grid
+    :return: integer cell of the position (used as a key of the grid and the occupancy index)
+    """
+    return round(pos[0]), round(pos[1])
+
+
+# background music of the levels, streamed (see audio.Music)
+DEFAULT_MUSIC = "sounds/sea.ogg"
+
+
 @dataclass
 class Config:
     """Config class for tile layers"""
 
     TILE_LAYER = 0
 
+    TOGGLE_FRAME_TIMES = pygame.K_F3
+
+    # tags in the names of layers (set in WorldD), e.g. "rocks [walkable]" or "notes [hidden]"
+    # the tile layer is walkable unless it is tagged [solid], the other layers only when tagged [walkable].
+    # cells of a layer tagged [solid] are never walkable, whatever the other layers say
+    WALKABLE_TAG = "walkable"
+    SOLID_TAG = "solid"
+    HIDDEN_TAG = "hidden"
+
     MOVE_UP = pygame.K_w
     MOVE_LEFT = pygame.K_a
     MOVE_RIGHT = pygame.K_d
     MOVE_DOWN = pygame.K_s
 
 
+class TextureCache:
+    """
+    process-wide cache of textures cut out of the sprite sheet.
+    textures are keyed by (tile group, tile name, tile size), so every world and entity shares one surface per distinct tile.
+    """
+
+    def __init__(self):
+        self.textures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sp_sheet, tile_group, tile_name, rect, size=None, flip=False):
+        """
+        :param sp_sheet: sprite sheet the texture is cut out of
+        :param tile_group: name of the tile group (entities use "entities")
+        :param tile_name: name of the tile
+        :param rect: position of the texture on the sprite sheet
+        :param size: size the texture is scaled to, if None then it is not scaled
+        :param flip: should the texture be flipped horizontally?
+        :return: texture
+        :rtype: pygame.Surface
+        """
+        rect = tuple(map(int, rect))
+        size = rect[2:] if size is None else tuple(map(int, size))
+        # the rect is a part of the key, so tiles sharing a name in different worlds can't collide
+        key = (tile_group, tile_name, size, rect, flip)
+        if key in self.textures:
+            self.hits += 1
+            return self.textures[key]
+        self.misses += 1
+        texture = sp_sheet.subsurface(rect)
+        if size != rect[2:]:
+            texture = pygame.transform.scale(texture, size)
+        if flip:
+            texture = pygame.transform.flip(texture, True, False)
+        self.textures[key] = texture
+        return texture
+
+    @property
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def clear(self):
+        self.textures.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<TextureCache textures:{len(self.textures)} hits:{self.hits} misses:{self.misses} hit rate:{self.hit_rate:.2f}>"
+
+
+texture_cache = TextureCache()
+
+
+class TextCache:
+    """
+    bounded cache of rendered (and outlined) text, the least recently used text is dropped when it is full.
+    text only changes after a move, so frames in between do no font work at all.
+    """
+
+    def __init__(self, max_size=64):
+        """
+        :param max_size: maximum amount of cached surfaces
+        """
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, font, text, color, outline_color=None, size=None, wraplength=0, align=pygame.FONT_LEFT):
+        """
+        returned surfaces are shared, copy them before changing them (set_alpha etc.).
+        :param font: pygame.Font the text is rendered with
+        :param text: rendered text
+        :param color: color of the text
+        :param outline_color: color of the outline, if None then the text isn't outlined
+        :param size: point size of the text, if None then the current size of the font
+        :param wraplength: width the text is wrapped at, 0 for no wrapping
+        :param align: alignment of the lines (pygame.FONT_LEFT, FONT_CENTER or FONT_RIGHT)
+        :return: rendered text
+        :rtype: pygame.Surface
+        """
+        size = font.point_size if size is None else size
+        key = (font, text, size, tuple(color), None if outline_color is None else tuple(outline_color), wraplength, align)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        old_size, old_align = font.point_size, font.align
+        font.point_size = size
+        font.align = align
+        surface = font.render(text, False, color, wraplength=wraplength)
+        font.point_size = old_size
+        font.align = old_align
+        if outline_color is not None:
+            surface = outline(surface, outline_color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    @property
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<TextCache surfaces:{len(self.surfaces)} hits:{self.hits} misses:{self.misses} hit rate:{self.hit_rate:.2f}>"
+
+
+text_cache = TextCache()
+
+
+@dataclass(frozen=True)
+class LayerInfo:
+    """metadata of a layer of a world, read from the tags in its name"""
+
+    name: str
+    visible: bool = True
+    walkable: bool = False
+    solid: bool = False
+
+    @classmethod
+    def from_name(cls, name, idx):
+        """
+        :param name: name of the layer
+        :param idx: index of the layer in the grid
+        :rtype: LayerInfo
+        """
+        tags = set(re.findall(r"\[(\w+)\]", name.lower()))
+        solid = Config.SOLID_TAG in tags
+        walkable = not solid and (Config.WALKABLE_TAG in tags or idx == Config.TILE_LAYER)
+        return cls(name, Config.HIDDEN_TAG not in tags, walkable, solid)
+
+
+def walkable_layer(grid, layer_names):
+    """
+    :param grid: layers of a world
+    :param layer_names: names of the layers
+    :return: position -> (tile group, tile name) of the walkable layers, later layers cover the earlier ones,
+        without the cells of the solid layers
+    """
+    cells = {}
+    solid = []
+    for idx, (layer, name) in enumerate(zip(grid, layer_names)):
+        info = LayerInfo.from_name(name, idx)
+        if info.walkable:
+            cells.update(layer)
+        elif info.solid:
+            solid.append(layer)
+    for layer in solid:
+        for pos in layer:
+            cells.pop(pos, None)
+    return cells
+
+
+class TerrainChunk:
+    """occupied cells of a block of rows and columns of a layer, baked into one surface the first time it is visible"""
+
+    def __init__(self, cells, positions, tile_size):
+        """
+        :param cells: cells of the chunk, row by row from the left
+        :param positions: screen positions of the cells without the camera offset
+        :param tile_size: size of a tile on the screen
+        """
+        self.cells = cells
+        self.positions = positions
+        left = min(x for x, _ in positions)
+        top = min(y for _, y in positions)
+        self.rect = pygame.Rect(
+            left,
+            top,
+            math.ceil(max(x for x, _ in positions) + tile_size[0] - left),
+            math.ceil(max(y for _, y in positions) + tile_size[1] - top),
+        )
+        self.surface = None
+
+
+class TerrainLayer:
+    """one layer of a world: its metadata, occupied cells and the chunks"""
+
+    def __init__(self, info: LayerInfo, cells):
+        self.info = info
+        self.cells = cells
+        self.visible = info.visible
+        # (first row, last row, chunks of the rows from the rightmost column)
+        self.bands = []
+        self.last_rows = []
+
+
 class World:
+    # rows and columns of the ground layer (Config.TILE_LAYER) baked into one surface, the chunks of the other layers
+    # are one row high, so everything standing in between their rows is drawn in between them
+    CHUNK_ROWS = 32
+    CHUNK_COLUMNS = 32
+
     def __init__(self, main, world_path, max_move_count):
         # load the world and export the most important things
-        tile_size, _, self.tiles, self.grid, layer_names = WorldD.load(world_path)
+        # world_path can also be already loaded world data (e.g. from a level pack)
+        if isinstance(world_path, str):
+            # the parsed file is shared between every world using it
+            world_path = WorldD.cached_load(world_path)
+        tile_size, _, self.tiles, self.grid, self.layer_names = world_path
         # scale the tile size
         self.tile_size = pygame.Vector2(tile_size)
 
@@ -113,9 +394,20 @@ class World:
 
         # setup how many tiles there will be in one row and column
 
-        # setup caching for better performance
-        self.tile_cache = {Config.TILE_LAYER: {}}
-        self.block_render_pos_cache = {}
+        # screen positions of the cells (isometric projection with the camera offset), rebuilt when the offset or
+        # the tile size changes
+        self.projection = {}
+        self.projection_offset = None
+        self.projection_tile_size = None
+
+        # every layer is drawn in order, the terrain never changes inside a level, so the layers are baked once
+        self.layers = [
+            TerrainLayer(LayerInfo.from_name(name, idx), layer)
+            for idx, (layer, name) in enumerate(zip(self.grid, self.layer_names))
+        ]
+        self.terrain_key = None
+        # cells the player and the entities can walk on (layers marked as walkable)
+        self.walkable = walkable_layer(self.grid, self.layer_names)
 
         self.move_count = 0
         self.max_move_count = max_move_count
@@ -125,69 +417,174 @@ class World:
             offset = self.main.offset[0] * self.tile_size[0], self.main.offset[1] * self.tile_size[1]
         return pygame.Vector2(pos[0] - offset[0], pos[1] - offset[1]) // self.tile_size[0]
 
-    def block_render_pos(self, grid_pos, offset: typing.Union[typing.Sequence[int], None] = None) -> tuple[int, int]:
+    def project(self, cells, offset):
+        """
+        isometric projection of many cells at once (vectorized when numpy is installed).
+        :parameter cells: sequence of grid positions
+        :parameter offset: offset added to every position
+        :returns: screen positions in the order of the cells, numpy array of shape (n, 2) or list of tuples
+        """
+        tile_w, tile_h = self.tile_size
+        if numpy is not None:
+            grid = numpy.asarray(cells, dtype=float).reshape(-1, 2)
+            x = tile_w * grid[:, 0]
+            x += grid[:, 1] / 2 * tile_w
+            x += offset[0]
+            y = tile_h * grid[:, 1]
+            y *= 0.25
+            y += offset[1]
+            return numpy.column_stack((x, y))
+        return [(tile_w * x + y / 2 * tile_w + offset[0], tile_h * y * 0.25 + offset[1]) for x, y in cells]
+
+    def update_projection(self):
+        """projects every occupied cell with the current camera offset and tile size"""
+        self.projection_offset = self.main.offset.copy()
+        self.projection_tile_size = self.tile_size.copy()
+        cells = list({cell for layer in self.grid for cell in layer})
+        positions = self.project(cells, self.main.offset * self.tile_size[0])
+        if numpy is not None:
+            positions = positions.tolist()
+        self.projection = dict(zip(cells, map(tuple, positions)))
+
+    def block_render_pos(self, grid_pos, offset: typing.Union[typing.Sequence[int], None] = None) -> pygame.Vector2:
         """
         :parameter grid_pos: position on the grid
-        :parameter offset: offset of Main offset * tile size, if not given then calculated in this function.
+        :parameter offset: offset of Main offset * tile size, if not given then the camera offset.
         :returns: position where tile should be rendered based on the grid position
         """
-        if tuple(grid_pos) not in self.block_render_pos_cache:
-            self.block_render_pos_cache[tuple(grid_pos)] = self.tile_size.elementwise() * grid_pos
-        if offset is None:
-            offset = self.main.offset * self.tile_size[0]
-        res = self.block_render_pos_cache[tuple(grid_pos)].copy()
+        if offset is not None:
+            return pygame.Vector2(tuple(self.project((tuple(grid_pos),), offset)[0]))
+        if self.projection_offset != self.main.offset or self.projection_tile_size != self.tile_size:
+            self.update_projection()
+        cell = tuple(grid_pos)
+        pos = self.projection.get(cell)
+        if pos is None:
+            # cells outside of the layers (knockbacks off the world)
+            pos = self.projection[cell] = tuple(self.project((cell,), self.main.offset * self.tile_size[0])[0])
+        return pygame.Vector2(pos)
+
+    def get_tile_texture(self, pos, layer=Config.TILE_LAYER):
+        """
+        :parameter pos: position on the grid of an existing tile
+        :parameter layer: index of the layer of the tile
+        :returns: scaled texture of the tile
+        """
+        # gather the information about tile group and name
+        tile_group, tile_name = self.grid[layer][pos]
+        # get subsurface pos
+        tile_subsurface_pos = self.tiles[tile_group].tiles[tile_name]
+        # get the scaled texture shared by every world
+        return texture_cache.get(self.sp_sheet, tile_group, tile_name, tile_subsurface_pos, self.tile_size)
+
+    def invalidate_terrain(self):
+        """forces the terrain to be baked again on the next render (call it after editing the grid)"""
+        self.terrain_key = None
+        self.projection_tile_size = None
+
+    def visible_rows(self, rect, offset):
+        """
+        :param rect: part of the display
+        :param offset: camera offset the tiles are drawn with (the same as in render)
+        :return: first and last row of the grid with tiles reaching into the rect
+        """
+        row_height = self.tile_size[1] * 0.25
+        first_row = math.ceil((rect[1] - offset[1] - self.tile_size[1]) / row_height)
+        return first_row, math.floor((rect[1] + rect[3] - offset[1]) / row_height)
 
-        # Isometric mapping
-        res.y *= 0.25
-        res.x += grid_pos[1] / 2 * self.tile_size[0]
-        # if grid_pos[1] % 2 == 1:
-        # 	res.x += self.tile_size[0] * .5
+    def depth(self, render_pos):
+        """
+        :param render_pos: render position of a tile (or of an entity standing on it)
+        :return: isometric depth of the position, the row of the grid, fractional in between two rows
+        """
+        return (render_pos[1] - self.main.offset[1] * self.tile_size[0]) / (self.tile_size[1] * 0.25)
 
-        res = res.elementwise() + offset
-        return res
+    def set_layer_visible(self, layer, visible):
+        """
+        :param layer: index of the layer
+        :param visible: should the layer be drawn?
+        """
+        self.layers[layer].visible = visible
 
-    def render(self):
-        offset = self.main.offset[0] * self.tile_size[0], self.main.offset[1] * self.tile_size[1]
-        left, top = -int(offset[0] // self.tile_size[0]) - 1, -int(offset[1] // self.tile_size[1]) - 1
-        right, bottom = (
-            int(left + self.display.get_width() // self.tile_size[0]) + 2,
-            int(top + self.display.get_height() // self.tile_size[1]) + 1,
-        )
-        bottom += 3
-        # for every column visible
-        for y in range(top, bottom):
-            # for every row visible
-            for x in range(left, right):
-                # if tile doesn't exist: next loop
-                if (x, y) not in self.grid[Config.TILE_LAYER]:
-                    continue
-                # if tile not cache:
-                if (x, y) not in self.tile_cache[Config.TILE_LAYER]:
-                    # gather the information about tile group and name
-                    tile_group, tile_name = self.grid[Config.TILE_LAYER][(x, y)]
-                    # get subsurface pos
-                    tile_subsurface_pos = self.tiles[tile_group].tiles[tile_name]
-                    # get texture
-                    tile_texture = self.sp_sheet.subsurface(tile_subsurface_pos)
-                    # scale texture
-                    tile_texture = pygame.transform.scale(tile_texture, self.tile_size)
-                    # cache it
-                    self.tile_cache[Config.TILE_LAYER][(x, y)] = tile_texture
-                else:
-                    # if tile is in cache: retrieve it
-                    tile_texture = self.tile_cache[Config.TILE_LAYER][(x, y)]
+    def bake_terrain(self):
+        """
+        splits the tiles of every layer into chunks of CHUNK_ROWS rows (one row outside of the ground layer) and
+        CHUNK_COLUMNS columns of the grid. a chunk is baked the first time it is visible, so the memory grows with the
+        occupied (and seen) cells, not the map size.
+        positions are calculated without the camera offset, so the surfaces stay valid when the offset changes.
+        """
+        self.terrain_key = (tuple(self.tile_size), tuple(map(len, self.grid)))
+        for idx, layer in enumerate(self.layers):
+            rows = self.CHUNK_ROWS if idx == Config.TILE_LAYER else 1
+            bands = {}
+            # row by row from the left, so overlapping tiles stay the same
+            for x, y in sorted(layer.cells, key=lambda cell: (cell[1], cell[0])):
+                bands.setdefault(y // rows, {}).setdefault(x // self.CHUNK_COLUMNS, []).append((x, y))
+            layer.bands = []
+            for _, columns in sorted(bands.items()):
+                chunks = []
+                # a tile is overlapped by tiles of the next rows in the same or the lower columns,
+                # so the chunks are drawn from the rightmost one
+                for _, cells in sorted(columns.items(), reverse=True):
+                    positions = self.project(cells, (0, 0))
+                    if numpy is not None:
+                        positions = positions.tolist()
+                    chunks.append(TerrainChunk(cells, positions, self.tile_size))
+                first_row = min(chunk.cells[0][1] for chunk in chunks)
+                layer.bands.append((first_row, max(chunk.cells[-1][1] for chunk in chunks), chunks))
+            layer.last_rows = [last_row for _, last_row, _ in layer.bands]
+
+    def bake_chunk(self, chunk: TerrainChunk, layer):
+        """
+        :param chunk: chunk of the layer
+        :param layer: index of the layer
+        :return: tiles of the chunk baked into one surface
+        """
+        if chunk.surface is None:
+            chunk.surface = pygame.Surface(chunk.rect.size, pygame.SRCALPHA)
+            chunk.surface.fblits(
+                [
+                    (self.get_tile_texture(pos, layer), (x - chunk.rect.x, y - chunk.rect.y))
+                    for pos, (x, y) in zip(chunk.cells, chunk.positions)
+                ]
+            )
+        return chunk.surface
 
-                # render tile
-                self.display.blit(tile_texture, self.block_render_pos((x, y), offset=offset))
+    def render(self):
+        if self.terrain_key != (tuple(self.tile_size), tuple(map(len, self.grid))):
+            self.bake_terrain()
+        offset = pygame.Vector2(self.main.offset[0] * self.tile_size[0], self.main.offset[1] * self.tile_size[1])
+        display_rect = self.display.get_rect()
+        # the display without the camera offset (chunk rects are without it), with a pixel for the rounding
+        view = display_rect.move(-math.floor(offset[0]), -math.floor(offset[1])).inflate(2, 2)
+        first_row, last_row = self.visible_rows(display_rect, offset)
+        for idx, layer in enumerate(self.layers):
+            if not layer.visible:
+                continue
+            # the ground is under everything standing on its rows. a one-row chunk of the other layers sorts half
+            # a row before its row: in front of the sprites on the row before it, behind the ones standing on it
+            under = 1 if idx == Config.TILE_LAYER else 0.5
+            for first, _, chunks in layer.bands[bisect_left(layer.last_rows, first_row) :]:
+                if first > last_row:
+                    break
+                depth = first - under
+                for column, chunk in enumerate(chunks):
+                    if chunk.rect.colliderect(view):
+                        self.main.queue_draw(
+                            (0, idx, first, column), self.bake_chunk(chunk, idx), offset + chunk.rect.topleft, depth
+                        )
 
 
 class Player:
     def __init__(self, main):
         self.main: Main = main
         self.grid_pos = pygame.Vector2()
-        self.last_move = (0, 0)
         self.render_pos = self.main.worlds[0].block_render_pos(self.grid_pos)
-        self.images = (main.sp_sheet.subsurface(16, 32, 16, 16), main.sp_sheet.subsurface(16, 16, 16, 16))
+        # render position of the previous simulation step, frames are drawn in between
+        self.last_render_pos = self.render_pos.copy()
+        self.images = (
+            texture_cache.get(main.sp_sheet, "entities", "player-hurt", (16, 32, 16, 16)),
+            texture_cache.get(main.sp_sheet, "entities", "player", (16, 16, 16, 16)),
+        )
         self.offset = pygame.Vector2(0, 16) / 4
         self.ready_for_next_move = True
         self.max_health = 2
@@ -203,8 +600,17 @@ class Player:
         if self.__health <= 0:
             self.main.death_screen.fade(255)
 
+    def sync(self, state: engine.State):
+        """updates the view from the state of the level"""
+        self.grid_pos = pygame.Vector2(state.player)
+        if self.health != state.health:
+            self.health = state.health
+
     def render(self):
-        self.main.display.blit(self.images[max(self.health - 1, 0)], self.render_pos - self.offset)
+        render_pos = interpolate(self.last_render_pos, self.render_pos, self.main.scheduler.alpha)
+        self.main.queue_draw(
+            (2,), self.images[max(self.health - 1, 0)], render_pos - self.offset, self.main.current_world.depth(render_pos)
+        )
 
     def update(self):
         self.move()
@@ -213,99 +619,131 @@ class Player:
         if self.main.current_world is None:
             return
         dest_render_pos = self.main.current_world.block_render_pos(self.grid_pos)
+        self.last_render_pos.update(self.render_pos)
         self.render_pos.move_towards_ip(dest_render_pos, self.main.dt * 20)
         if self.render_pos == dest_render_pos:
             self.ready_for_next_move = True
 
 
 class Entity:
+    """view of an engine.EntityState, the rules live in engine.step"""
+
+    kind = None
+
     def __init__(self, main, grid_pos, image):
         self.main = main
         self.grid_pos = pygame.Vector2(grid_pos)
         self.org_grid_pos = pygame.Vector2(grid_pos)
         self.render_pos = pygame.Vector2()
+        self.last_render_pos = pygame.Vector2()
         self.image = image
         self.render_offset = pygame.Vector2() / 2
         self.move_speed = 20
+        # key of the entity in the draw queue, the world sets it to the index of the entity
+        self.draw_key = (1, 0)
+
+    @classmethod
+    def spawn_state(cls, grid_pos) -> engine.EntityState:
+        """
+        :param grid_pos: position where the entity spawns
+        :return: state of the entity when the level starts (it doesn't need a view, so it works without a display)
+        """
+        return engine.EntityState(cls.kind, grid_cell(grid_pos))
+
+    def initial_state(self) -> engine.EntityState:
+        return self.spawn_state(self.org_grid_pos)
+
+    def sync(self, state: engine.EntityState):
+        """updates the view from the state of the entity"""
+        self.grid_pos = pygame.Vector2(state.cell)
 
     def setup(self):
-        self.grid_pos = self.org_grid_pos.copy()
-        self.render_pos = self.main.current_world.block_render_pos(self.grid_pos)
+        self.place(self.main.current_world.block_render_pos(self.grid_pos))
 
-    def draw(self):
+    def place(self, render_pos):
+        """moves the entity to the position without animating it"""
+        self.render_pos = pygame.Vector2(render_pos)
+        self.last_render_pos = self.render_pos.copy()
+
+    def move(self):
+        """one simulation step of the animation towards the grid position"""
+        self.last_render_pos.update(self.render_pos)
         self.render_pos.move_towards_ip(self.main.current_world.block_render_pos(self.grid_pos), self.main.dt * self.move_speed)
-        self.main.display.blit(self.image, self.render_pos + self.render_offset)
 
     @property
-    def can_move(self):
-        return self.render_pos == self.main.current_world.block_render_pos(self.grid_pos)
+    def interpolated_pos(self):
+        return interpolate(self.last_render_pos, self.render_pos, self.main.scheduler.alpha)
+
+    def depth(self, render_pos):
+        """
+        :param render_pos: interpolated render position of the entity
+        :return: isometric depth of the entity in the draw queue
+        """
+        return self.main.current_world.depth(render_pos)
 
-    def on_can_move(self):
-        pass
+    def draw(self):
+        render_pos = self.interpolated_pos
+        self.main.queue_draw(self.draw_key, self.image, render_pos + self.render_offset, self.depth(render_pos))
 
-    def move(self, direction):
-        self.on_can_move()
-        self.grid_pos += direction
+    @property
+    def can_move(self):
+        return self.render_pos == self.main.current_world.block_render_pos(self.grid_pos)
 
 
 class Shark(Entity):
+    kind = engine.SHARK
+
     def __init__(self, main, grid_pos, direction=(0, 1)):
-        self.org_image = main.sp_sheet.subsurface((32, 16, 16, 16))
-        super().__init__(main, grid_pos, self.org_image)
+        self.org_flipped = direction[0] != 0 or direction[1] != 1
+        self.flipped = self.org_flipped
+        super().__init__(main, grid_pos, self.get_image(main, self.flipped))
         self.org_direction = pygame.Vector2(direction)
-        if direction[0] != 0:
-            self.org_image = pygame.transform.flip(self.image, True, False)
-        if direction[1] != 1:
-            self.org_image = pygame.transform.flip(self.image, True, False)
         self.direction = self.org_direction.copy()
-        self.can_attack = False
 
-    def setup(self):
-        super().setup()
-        self.direction = self.org_direction.copy()
-        self.image = self.org_image.copy()
+    @staticmethod
+    def get_image(main, flipped):
+        return texture_cache.get(main.sp_sheet, "entities", "shark", (32, 16, 16, 16), flip=flipped)
+
+    @classmethod
+    def spawn_state(cls, grid_pos, direction=(0, 1)) -> engine.EntityState:
+        return engine.EntityState(cls.kind, grid_cell(grid_pos), grid_cell(direction))
+
+    def initial_state(self) -> engine.EntityState:
+        return self.spawn_state(self.org_grid_pos, self.org_direction)
+
+    def sync(self, state: engine.EntityState):
+        super().sync(state)
+        self.direction = pygame.Vector2(state.direction)
+        # the shark turns around by bouncing off the edge of the world
+        self.flipped = self.org_flipped != (self.direction != self.org_direction)
+        self.image = self.get_image(self.main, self.flipped)
 
     def render(self):
         super().draw()
-        if self.render_pos.distance_to(self.main.player.render_pos) <= 2 and self.can_attack:
-            self.grid_pos -= self.direction
-            self.main.player.health -= 1
-            self.main.player.grid_pos -= self.main.player.last_move
-            self.can_attack = False
-
-    def on_can_move(self):
-        if tuple(self.grid_pos + self.direction) not in self.main.current_world.grid[0]:
-            print("out of the world I go")
-            self.direction *= -1
-            self.image = pygame.transform.flip(self.image, True, False)
-        self.can_attack = True
-
-    def update(self):
-        super().move(self.direction)
 
 
 class Storm(Entity):
+    kind = engine.STORM
+
     def __init__(self, main, grid_pos):
-        super().__init__(main, grid_pos, main.sp_sheet.subsurface(0, 32, 16, 16))
+        super().__init__(main, grid_pos, texture_cache.get(main.sp_sheet, "entities", "storm", (0, 32, 16, 16)))
         self.move_speed = 40
 
     def setup(self):
-        self.grid_pos = self.org_grid_pos
-        self.render_pos = self.main.current_world.block_render_pos(self.grid_pos) - (0, 64)
+        self.place(self.main.current_world.block_render_pos(self.grid_pos) - (0, 64))
+
+    def depth(self, render_pos):
+        # the storm drops from above the screen onto its cell and never leaves it, so it stands on its row all along
+        # (the raised position would sort it behind the terrain)
+        return self.grid_pos.y
 
     def render(self):
         super().draw()
-        if self.main.player.render_pos == self.render_pos and self.main.current_world.move_count > 0:
-            self.main.player.health -= 1
-            self.main.player.grid_pos += random.choice(((-1, 0), (1, 0), (0, 1), (0, -1)))
-
-    def update(self):
-        pass
 
 
 class Ending:
     def __init__(self, main, image_path):
-        self.image = pygame.image.load(image_path).convert()
+        self.image = main.assets.image(image_path, alpha=False)
         self.main: Main = main
 
     def render(self):
@@ -321,6 +759,9 @@ class DeathScreen(Ending):
         self.title = "You died!"
         self.title_size = 30
         self.subtitle = "Press R to restart."
+        # the image is shared with the other overlays and the text comes from text_cache, their alpha is set on copies
+        self.image = self.image.copy()
+        self.faded_text = {}
 
     def fade(self, dst_alpha, speed=None):
         """
@@ -334,26 +775,47 @@ class DeathScreen(Ending):
         """
         self.dst_alpha = dst_alpha
         self.main.dst_display_alpha = 255
+        if dst_alpha:
+            self.main.music.play(None)
         if speed is not None:
             self.dst_speed = speed
 
-    def render(self):
+    def update(self):
         self.alpha = pygame.math.lerp(self.alpha, self.dst_alpha, self.main.dt * self.dst_speed)
+
+    def faded(self, name, text):
+        """
+        :param name: which text of the overlay it is ("title" or "subtitle")
+        :param text: text from text_cache
+        :return: own copy of the text with the alpha of the overlay, copied again only when the cached text changes
+        """
+        source, surface = self.faded_text.get(name, (None, None))
+        if source is not text:
+            surface = text.copy()
+            self.faded_text[name] = (text, surface)
+        surface.set_alpha(self.alpha)
+        return surface
+
+    def render(self):
         if self.alpha <= 1:
             return
         self.image.set_alpha(self.alpha)
 
-        old_size = self.main.font.point_size
-        self.main.font.point_size = self.title_size
-        self.main.font.align = pygame.FONT_CENTER
-        title = self.main.font.render(self.title, False, self.main.text_color, wraplength=self.main.display.get_width())
-        title = outline(title, self.main.text_outline)
-        title.set_alpha(self.alpha)
-
-        self.main.font.set_point_size(old_size)
-        subtitle = self.main.font.render(self.subtitle, False, self.main.text_color)
-        subtitle = outline(subtitle, self.main.text_outline)
-        subtitle.set_alpha(self.alpha)
+        title = self.faded(
+            "title",
+            text_cache.get(
+                self.main.font,
+                self.title,
+                self.main.text_color,
+                self.main.text_outline,
+                self.title_size,
+                self.main.display.get_width(),
+                pygame.FONT_CENTER,
+            ),
+        )
+
+        subtitle = text_cache.get(self.main.font, self.subtitle, self.main.text_color, self.main.text_outline)
+        subtitle = self.faded("subtitle", subtitle)
         subtitle_pos = pygame.Vector2(subtitle.get_rect(center=pygame.Vector2(self.main.display.get_size()) / 2).midleft)
 
         subtitle_pos.y += math.sin(pygame.time.get_ticks() / 600) * 4
@@ -371,15 +833,58 @@ class TooManyMoves(DeathScreen):
 
 
 class CustomWorld(World):
-    def __init__(self, main, world_path, entities, max_move_count=5):
+    def __init__(self, main, world_path, entities, max_move_count=5, music=DEFAULT_MUSIC):
         super().__init__(main, world_path, 5)
         self.entities = entities
+        for idx, entity in enumerate(entities):
+            entity.draw_key = (1, idx)
         self.max_move_count = max_move_count
+        self.music = music
+        # rules of the level, the entities and the player only show self.state
+        self.board = engine.board_from_grid(
+            self.walkable, [entity.initial_state() for entity in entities], max_move_count
+        )
+        self.state = None
+
+    def reset(self, seed, health=None):
+        """
+        starts the level from the beginning.
+        :param seed: state of the random number generator
+        :param health: health of the player, if None then full health
+        """
+        self.state = engine.start(self.board, seed, health)
+        self.sync()
+
+    def step(self, move) -> bool:
+        """
+        plays one turn.
+        :param move: move of the player
+        :return: False if the move isn't possible
+        """
+        state = engine.step(self.board, self.state, move)
+        if state is self.state:
+            return False
+        self.state = state
+        self.sync()
+        return True
+
+    def sync(self):
+        """updates the player and the entities from the state"""
+        self.move_count = self.state.move_count
+        for entity, entity_state in zip(self.entities, self.state.entities):
+            entity.sync(entity_state)
+        self.main.player.sync(self.state)
 
 
 class Fog(Entity):
+    kind = engine.FOG
+    # amount of precomputed alpha phases of the fog animation
+    PHASES = 32
+    # phases shared by every fog, created with the first fog
+    frames: tuple[pygame.Surface, ...] = ()
+
     def __init__(self, main, grid_pos):
-        super().__init__(main, grid_pos, main.sp_sheet.subsurface(0, 48, 16, 16))
+        super().__init__(main, grid_pos, texture_cache.get(main.sp_sheet, "entities", "fog", (0, 48, 16, 16)))
         self.fog_color = pygame.Color("#221228")
         self.fog_points = [
             pygame.Vector2(-4, 2),
@@ -390,232 +895,415 @@ class Fog(Entity):
             pygame.Vector2(0, 8),
             pygame.Vector2(0, 0),
         ]
-        self.circle = pygame.Surface((8, 8), pygame.SRCALPHA)
-        pygame.draw.circle(self.circle, self.fog_color, (4, 4), 3)
+        if not Fog.frames:
+            Fog.frames = self.create_frames(self.fog_color)
         self.offset = random.random() * 10
 
-    def setup(self):
-        self.render_pos = self.main.current_world.block_render_pos(self.grid_pos)
+    @classmethod
+    def create_frames(cls, color):
+        """
+        :param color: color of the fog
+        :return: circle of fog with alpha baked in for every phase of the animation
+        :rtype: tuple[pygame.Surface, ...]
+        """
+        circle = pygame.Surface((8, 8), pygame.SRCALPHA)
+        pygame.draw.circle(circle, color, (4, 4), 3)
+        frames = []
+        for phase in range(cls.PHASES):
+            alpha = pygame.math.clamp(math.cos(phase / cls.PHASES * math.tau) * 64 + 128 + 80, 0, 255)
+            frame = circle.copy()
+            frame.fill((255, 255, 255, round(alpha)), special_flags=pygame.BLEND_RGBA_MULT)
+            frames.append(frame)
+        return tuple(frames)
 
     def render(self):
         super().draw()
+        render_pos = self.interpolated_pos
+        depth = self.depth(render_pos)
+        seconds = pygame.time.get_ticks() / 1000 + self.offset
         for idx, point in enumerate(self.fog_points):
-            self.circle.set_alpha(math.cos(pygame.time.get_ticks() / 1000 + self.offset + idx * 200) * 64 + 128 + 80)
-            dst_pos = self.render_pos + (8, 0) + point.xy
-            pos = dst_pos - (3, 3)
-            self.main.display.blit(self.circle, pos)
-        if (self.render_pos).distance_to(self.main.player.render_pos) <= 2:
-            self.main.player.health = 0
+            phase = int((seconds + idx * 200) / math.tau * self.PHASES) % self.PHASES
+            self.main.queue_draw(
+                (*self.draw_key, idx), self.frames[phase], (render_pos.x + 5 + point.x, render_pos.y - 3 + point.y), depth
+            )
 
-    def update(self):
-        pass
+
+@dataclass(frozen=True)
+class Level:
+    """lightweight description of a level, the world and its entities are built only when the level is reached"""
+
+    world_path: str
+    entities: tuple = ()
+    max_move_count: int = 5
+    music: str = DEFAULT_MUSIC
+
+    def build(self, main):
+        """
+        :param main: Main
+        :return: world with freshly created entities
+        :rtype: CustomWorld
+        """
+        return CustomWorld(
+            main, self.world_path, [entity(main, *args) for entity, *args in self.entities], self.max_move_count, self.music
+        )
+
+    def board(self) -> engine.Board:
+        """:return: rules of the level without building the world"""
+        _, _, _, grid, layer_names = WorldD.cached_load(self.world_path)
+        return engine.board_from_grid(
+            walkable_layer(grid, layer_names),
+            [entity.spawn_state(*args) for entity, *args in self.entities],
+            self.max_move_count,
+        )
+
+
+@dataclass(frozen=True)
+class PackedLevel:
+    """level stored in a level pack, read from the pack only when the level is reached"""
+
+    pack: levelpack.LevelPack
+    index: int
+
+    def build(self, main):
+        """
+        :param main: Main
+        :return: world with freshly created entities
+        :rtype: CustomWorld
+        """
+        level = self.pack.read(self.index)
+        entities = [
+            ENTITY_TYPES[entity](main, pos) if direction is None else ENTITY_TYPES[entity](main, pos, direction)
+            for entity, pos, direction in level.entities
+        ]
+        return CustomWorld(main, level.world, entities, level.max_move_count, level.music)
+
+    def board(self) -> engine.Board:
+        """:return: rules of the level without building the world"""
+        level = self.pack.read(self.index)
+        entities = [
+            ENTITY_TYPES[entity].spawn_state(pos) if direction is None else ENTITY_TYPES[entity].spawn_state(pos, direction)
+            for entity, pos, direction in level.entities
+        ]
+        return engine.board_from_grid(walkable_layer(level.world[3], level.world[4]), entities, level.max_move_count)
+
+
+class Levels:
+    """
+    registry of levels, builds a CustomWorld on the first access.
+    only the worlds inside the window (current level and the next one) are kept alive, the rest is released.
+    """
+
+    def __init__(self, main, levels, window=2):
+        self.main = main
+        self.levels = tuple(levels)
+        self.window = window
+        self.built: dict[int, CustomWorld] = {}
+        self.current = None
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, idx) -> CustomWorld:
+        if idx < 0:
+            idx += len(self.levels)
+        if not 0 <= idx < len(self.levels):
+            raise IndexError("level index out of range")
+        if idx not in self.built:
+            self.built[idx] = self.levels[idx].build(self.main)
+        if idx != self.current:
+            self.current = idx
+            for built_idx in tuple(self.built):
+                if not idx <= built_idx < idx + self.window:
+                    del self.built[built_idx]
+        return self.built[idx]
+
+    def prefetch(self, idx):
+        """builds the level ahead of time (if it is inside the window), so switching to it doesn't stall a frame"""
+        if self.current is not None and self.current <= idx < min(self.current + self.window, len(self.levels)):
+            if idx not in self.built:
+                self.built[idx] = self.levels[idx].build(self.main)
+
+
+LEVELS = (
+    Level("worlds/1.world", ((Shark, (0, 2)), (Shark, (-1, 3)))),
+    Level("worlds/1.world", ((Storm, (0, 1)), (Storm, (1, 0)), (Storm, (1, 1)), (Storm, (-2, 2)))),
+    Level(
+        "worlds/1.world",
+        (
+            (Storm, (-1, 0)),
+            (Storm, (-1, 1)),
+            (Shark, (-2, 2)),
+            (Shark, (-1, 4)),
+            (Shark, (-1, 1)),
+            (Shark, (1, -1)),
+        ),
+    ),
+    Level(
+        "worlds/1.world",
+        (
+            (Fog, (-1, 1)),
+            (Fog, (-2, 2)),
+            (Fog, (-2, 4)),
+            (Fog, (-1, 3)),
+            (Fog, (-1, 4)),
+            (Fog, (1, 0)),
+        ),
+        7,
+    ),
+    Level(
+        "worlds/1.world",
+        (
+            (Storm, (-2, 3)),
+            (Storm, (0, 1)),
+            (Shark, (-3, 5), (0, -1)),
+            (Shark, (-1, 2), (0, -1)),
+            (Shark, (-2, 4), (0, -1)),
+            (Shark, (-1, 3), (0, -1)),
+            (Fog, (-1, 1)),
+            (Fog, (-2, 2)),
+            (Fog, (-2, 4)),
+            (Fog, (-1, 3)),
+            (Fog, (0, 2)),
+        ),
+        9,
+    ),
+    Level(
+        "worlds/1.world",
+        (
+            (Storm, (0, 2)),
+            (Shark, (1, 2)),
+            (Shark, (-1, 2)),
+            (Shark, (-3, 5), (0, -1)),
+            (Fog, (-2, 2)),
+            (Fog, (-1, 1)),
+            (Fog, (0, 1)),
+            (Fog, (-1, 2)),
+            (Fog, (-1, 3)),
+            (Fog, (-2, 4)),
+            (Fog, (1, 2)),
+        ),
+        13,
+    ),
+    Level(
+        "worlds/1.world",
+        (
+            (Shark, (1, 0)),
+            (Shark, (1, -2)),
+            (Shark, (-2, 5)),
+            (Shark, (-3, 5)),
+            (Fog, (1, -2)),
+            (Fog, (0, -1)),
+            (Fog, (-2, 2)),
+            (Fog, (-2, 3)),
+            (Fog, (-1, 2)),
+            (Fog, (0, 1)),
+            (Fog, (0, 2)),
+            (Fog, (-1, 3)),
+        ),
+        11,
+    ),
+    Level(
+        "worlds/1.world",
+        (
+            (Storm, (0, 2)),
+            (Storm, (-2, 4)),
+            (Shark, (-1, 1), (-1, 1)),
+            (Shark, (-3, 5)),
+            (Shark, (1, -2)),
+            (Fog, (1, -2)),
+            (Fog, (-1, 0)),
+            (Fog, (-3, 2)),
+            (Fog, (0, 1)),
+            (Fog, (-1, 2)),
+            (Fog, (-2, 3)),
+            (Fog, (-1, 3)),
+            (Fog, (1, 2)),
+        ),
+        9,
+    ),
+    Level(
+        "worlds/1.world",
+        (
+            (Shark, (0, -1)),
+            (Shark, (-2, 3)),
+            (Shark, (-2, 5)),
+            (Shark, (-3, 3)),
+            (Fog, (1, -2)),
+            (Fog, (1, -1)),
+            (Fog, (1, 0)),
+            (Fog, (1, 1)),
+            (Fog, (1, 2)),
+            (Fog, (-1, 2)),
+            (Fog, (-2, 3)),
+            (Fog, (-1, 3)),
+            (Fog, (-2, 1)),
+            (Fog, (-3, 2)),
+        ),
+        5,
+    ),
+    Level(
+        "worlds/9.world",
+        (
+            (Shark, (-2, 4), (-1, 1)),
+            (Shark, (-3, 4), (0, -1)),
+            (Fog, (1, -2)),
+            (Fog, (1, -1)),
+            (Fog, (1, 0)),
+            (Fog, (0, 1)),
+            (Fog, (-2, 2)),
+            (Fog, (-2, 2)),
+            (Fog, (-2, 3)),
+            (Fog, (-2, 4)),
+        ),
+        8,
+    ),
+    Level(
+        "worlds/9.world",
+        (
+            (Shark, (1, -1), (0, 1)),
+            (Shark, (1, -1), (0, -1)),
+            (Shark, (0, -1)),
+            (Shark, (-1, 4), (0, -1)),
+            (Fog, (1, -2)),
+            (Fog, (0, -1)),
+            (Fog, (-2, 2)),
+            (Fog, (0, 1)),
+            (Fog, (-1, 2)),
+            (Fog, (-1, 3)),
+            (Fog, (-2, 2)),
+            (Fog, (-3, 5)),
+        ),
+        10,
+    ),
+)
+
+ENTITY_TYPES = {entity.__name__: entity for entity in (Shark, Storm, Fog)}
 
 
 class Main:
-    def __init__(self):
+    def __init__(self, level_pack=None, dirty_rects=False, seed=None, record=None, frame_times=None, max_fps=60, load=True):
 
         #self.window = pygame.Window("Travelling through Storm | ")
         #self.window.set_icon(pygame.image.load("icon.ico"))
         #self.window_surf = self.window.get_surface()
         print(420)
-        self.window_surf = pygame.display.set_mode([640, 480])
+        self.window_surf = pygame.display.set_mode([640, 480], pygame.RESIZABLE)
         self.title = 'Travelling through Storm | '
         print(426)
-        self.scale = 4
 
         self.display = pygame.Surface(pygame.Vector2(160, 120), pygame.SRCALPHA)
+        # scale, place and the scaled display are recalculated only when the window is resized
+        self.scale = 4
+        self.view_rect = pygame.Rect(0, 0, 640, 480)
+        self.scaled_display = None
+        self.resize(self.window_surf.get_size())
         self.display_alpha = 255
         self.dst_display_alpha = 255
+        # the game is simulated in fixed steps (update), frames are rendered in between them
+        self.scheduler = scheduler.FixedStep(1 / 60, max_fps)
+        self.dt = self.scheduler.step
+
+        self.background_color = pygame.Color("#221228")
+        # sounds are decoded by the asset loader, so the mixer has to be ready first (set up by pre_init at the top)
+        pygame.mixer.init()
+        self.music = audio.Music()
+        self.assets = assets.Assets()
+        for kind, path in (
+            ("image", "asset-spritesheet.png"),
+            ("image", "ending.png"),
+            ("image", "death.png"),
+            ("file", "font/Lobster.ttf"),
+            *(("sound", path) for path in map(audio.effect_path, audio.EFFECTS) if path is not None),
+        ):
+            self.assets.preload(kind, path)
+        if level_pack is None:
+            for world_path in {level.world_path for level in LEVELS}:
+                self.assets.preload("world", world_path)
+        self.level_pack = level_pack
+
+        # everything outlined with the world outline is queued and drawn at once in flush_draw_queue.
+        # the queue keeps its entries from frame to frame sorted by (depth, key), only entries which changed their
+        # depth are moved. draws: key -> [depth, image, position, frame it was queued in]
+        self.draw_queue = []
+        self.draws = {}
+        self.draw_frame = 0
+        self.hud_text = None
+        self.hud_surface = None
+        # dirty rects mode: only changed parts of the display are scaled and sent to the window
+        self.dirty_rects = dirty_rects
+        self.max_dirty_rects = 16
+        self.dirty = []
+        self.full_redraw = True
+        self.last_draws = {}
+        self.last_overlay_state = None
+        # seed of the storms, the state of the generator is carried from turn to turn and level to level
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.rng = self.seed
+        # input recording (replay.Recorder) and replayed input (replay.Replay), see replay.py
+        self.frame = 0
+        self.recorder = None if record is None else replay.Recorder(record, self.seed, level_pack, self.scheduler.step)
+        self.replay = None
+        # frame times of every phase, shown with Config.TOGGLE_FRAME_TIMES and exported to frame_times on exit
+        self.profiler = frametimes.FrameProfiler()
+        self.profiler.enabled = frame_times is not None
+        self.frame_times_path = frame_times
+        self.show_frame_times = False
+        self.frame_times_surface = None
+        self.last_frame_times = 0
+        self.frame_times_font = pygame.font.Font(None, 18)
+        self.clock = pygame.Clock()
+        self.last_caption = 0
+        self.text_color = pygame.Color("#652654")
+        self.text_outline = pygame.Color("#9e3455")
+        self.world_outline_color = pygame.Color("#652654")
+
+        # the rest needs the assets, it is set up right away or by async_run (browser)
+        self.loaded = False
+        if load:
+            self.load()
+
+    def load(self):
+        """waits for the assets, drawing the loading stage, and sets the game up"""
+        self.assets.wait(self.render_loading)
+        self.setup()
+
+    async def async_load(self):
+        """load() without blocking the event loop, so the browser can draw the loading stage"""
+        await self.assets.async_wait(self.render_loading)
+        self.setup()
+
+    def setup(self):
+        """sets up everything made of the assets"""
+        self.sp_sheet = self.assets.image("asset-spritesheet.png")
+        self.font = self.assets.font("font/Lobster.ttf", 15)
+        self.effects = audio.Effects(self.assets)
 
-        self.sp_sheet = pygame.image.load("asset-spritesheet.png").convert_alpha()
         self.cur_world_id = 0
-        self.worlds = (
-            CustomWorld(self, "worlds/1.world", [Shark(self, (0, 2)), Shark(self, (-1, 3))]),
-            CustomWorld(
-                self, "worlds/1.world", [Storm(self, (0, 1)), Storm(self, (1, 0)), Storm(self, (1, 1)), Storm(self, (-2, 2))]
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Storm(self, (-1, 0)),
-                    Storm(self, (-1, 1)),
-                    Shark(self, (-2, 2)),
-                    Shark(self, (-1, 4)),
-                    Shark(self, (-1, 1)),
-                    Shark(self, (1, -1)),
-                ],
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Fog(self, (-1, 1)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-2, 4)),
-                    Fog(self, (-1, 3)),
-                    Fog(self, (-1, 4)),
-                    Fog(self, (1, 0)),
-                ],
-                7,
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Storm(self, (-2, 3)),
-                    Storm(self, (0, 1)),
-                    Shark(self, (-3, 5), (0, -1)),
-                    Shark(self, (-1, 2), (0, -1)),
-                    Shark(self, (-2, 4), (0, -1)),
-                    Shark(self, (-1, 3), (0, -1)),
-                    Fog(self, (-1, 1)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-2, 4)),
-                    Fog(self, (-1, 3)),
-                    Fog(self, (0, 2)),
-                ],
-                9,
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Storm(self, (0, 2)),
-                    Shark(self, (1, 2)),
-                    Shark(self, (-1, 2)),
-                    Shark(self, (-3, 5), (0, -1)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-1, 1)),
-                    Fog(self, (0, 1)),
-                    Fog(self, (-1, 2)),
-                    Fog(self, (-1, 3)),
-                    Fog(self, (-2, 4)),
-                    Fog(self, (1, 2)),
-                ],
-                13,
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Shark(self, (1, 0)),
-                    Shark(self, (1, -2)),
-                    Shark(self, (-2, 5)),
-                    Shark(self, (-3, 5)),
-                    Fog(self, (1, -2)),
-                    Fog(self, (0, -1)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-2, 3)),
-                    Fog(self, (-1, 2)),
-                    Fog(self, (0, 1)),
-                    Fog(self, (0, 2)),
-                    Fog(self, (-1, 3)),
-                ],
-                11,
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Storm(self, (0, 2)),
-                    Storm(self, (-2, 4)),
-                    Shark(self, (-1, 1), (-1, 1)),
-                    Shark(self, (-3, 5)),
-                    Shark(self, (1, -2)),
-                    Fog(self, (1, -2)),
-                    Fog(self, (-1, 0)),
-                    Fog(self, (-3, 2)),
-                    Fog(self, (0, 1)),
-                    Fog(self, (-1, 2)),
-                    Fog(self, (-2, 3)),
-                    Fog(self, (-1, 3)),
-                    Fog(self, (1, 2)),
-                ],
-                9,
-            ),
-            CustomWorld(
-                self,
-                "worlds/1.world",
-                [
-                    Shark(self, (0, -1)),
-                    Shark(self, (-2, 3)),
-                    Shark(self, (-2, 5)),
-                    Shark(self, (-3, 3)),
-                    Fog(self, (1, -2)),
-                    Fog(self, (1, -1)),
-                    Fog(self, (1, 0)),
-                    Fog(self, (1, 1)),
-                    Fog(self, (1, 2)),
-                    Fog(self, (-1, 2)),
-                    Fog(self, (-2, 3)),
-                    Fog(self, (-1, 3)),
-                    Fog(self, (-2, 1)),
-                    Fog(self, (-3, 2)),
-                ],
-                5,
-            ),
-            CustomWorld(
-                self,
-                "worlds/9.world",
-                [
-                    Shark(self, (-2, 4), (-1, 1)),
-                    Shark(self, (-3, 4), (0, -1)),
-                    Fog(self, (1, -2)),
-                    Fog(self, (1, -1)),
-                    Fog(self, (1, 0)),
-                    Fog(self, (0, 1)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-2, 3)),
-                    Fog(self, (-2, 4)),
-                ],
-                8,
-            ),
-            CustomWorld(
-                self,
-                "worlds/9.world",
-                [
-                    Shark(self, (1, -1), (0, 1)),
-                    Shark(self, (1, -1), (0, -1)),
-                    Shark(self, (0, -1)),
-                    Shark(self, (-1, 4), (0, -1)),
-                    Fog(self, (1, -2)),
-                    Fog(self, (0, -1)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (0, 1)),
-                    Fog(self, (-1, 2)),
-                    Fog(self, (-1, 3)),
-                    Fog(self, (-2, 2)),
-                    Fog(self, (-3, 5)),
-                ],
-                10,
-            ),
-        )
+        if self.level_pack is None:
+            self.worlds = Levels(self, LEVELS)
+        else:
+            pack = levelpack.LevelPack(self.level_pack)
+            self.worlds = Levels(self, [PackedLevel(pack, idx) for idx in range(len(pack))])
         self.offset = self.worlds[0].get_block_pos(self.display.get_size(), offset=(0, 0)).elementwise() / 2 + (0, -0.5)
         self.player = Player(self)
         self.ending = Ending(self, "ending.png")
         self.death_screen = DeathScreen(self)
         self.too_much_moves = TooManyMoves(self)
-        for entity in self.worlds[self.cur_world_id].entities:
-            entity.setup()
-
-        self.dt = 0
-        self.clock = pygame.Clock()
-        self.FPS = 60
-
-        self.font = pygame.font.Font("font/Lobster.ttf", 15)
-        self.text_color = pygame.Color("#652654")
-        self.text_outline = pygame.Color("#9e3455")
-        self.background_color = pygame.Color("#221228")
-        self.world_outline_color = pygame.Color("#652654")
+        self.start_world()
+        self.loaded = True
 
-        pygame.mixer.init(channels=1)
-        self.sea_sound_channel = pygame.mixer.Channel(0)
-        self.sea_sound_channel.set_volume(0.3)
-        # self.player_move_sound_channel = pygame.mixer.Channel(1)
-        # self.player_attacked_sound_channel = pygame.mixer.Channel(2)
-        self.sea_sound = pygame.mixer.Sound("sounds/sea.ogg")
+    def render_loading(self, progress):
+        """
+        loading stage, drawn straight to the window while the assets are loaded
+        :param progress: loaded part of the assets (0 - 1)
+        """
+        pygame.event.pump()
+        self.window_surf.fill(self.background_color)
+        bar = pygame.Rect(0, 0, self.view_rect.width // 2, 4 * self.scale)
+        bar.center = self.view_rect.center
+        pygame.draw.rect(self.window_surf, "#652654", bar, self.scale)
+        pygame.draw.rect(self.window_surf, "#9e3455", (bar.x, bar.y, bar.width * progress, bar.height))
+        pygame.display.flip()
 
     @property
     def current_world(self) -> World | None:
@@ -623,26 +1311,49 @@ class Main:
             return None
         return self.worlds[self.cur_world_id]
 
+    def start_world(self, health=None):
+        """
+        starts the current world from the beginning.
+        :param health: health of the player, if None then full health
+        """
+        self.current_world.reset(self.rng, health)
+        for entity in self.current_world.entities:
+            entity.setup()
+        # the music stays faded out while the death or too many moves screen is shown
+        if not self.death_screen.dst_alpha and not self.too_much_moves.dst_alpha:
+            self.music.play(self.current_world.music)
+
     def render(self):
-        self.window_surf.fill(self.background_color)
+        profiler = self.profiler if self.profiler.enabled else None
+        if profiler:
+            profiler.lap()
         self.display.fill((0, 0, 0, 0))
 
         if self.current_world is not None and self.death_screen.alpha <= 1 and self.too_much_moves.alpha <= 1:
-            if self.sea_sound and not self.sea_sound_channel.get_busy():
-                self.sea_sound_channel.play(self.sea_sound)
             self.current_world.render()
+            if profiler:
+                profiler.lap("world")
             for entity in self.current_world.entities:
                 entity.render()
             self.player.render()
-            self.display.blit(outline(self.display, self.world_outline_color), (0, 0))
+            if profiler:
+                profiler.lap("entities")
+            self.flush_draw_queue()
+            if profiler:
+                profiler.lap("outline")
             text = (
                 f"Moves: {self.current_world.move_count} [/{self.current_world.max_move_count}]\n" f"Health: {self.player.health}"
             )
-            move_count_text = self.font.render(text, False, self.text_color)
-            move_count_text = outline(move_count_text, self.text_outline)
-            self.display.blit(move_count_text, (2, 2))
-        elif self.current_world is not None:
-            if self.sea_sound: self.sea_sound_channel.fadeout(1000)
+            # the text changes only after a move, so it is rendered only then
+            if text != self.hud_text:
+                if self.hud_surface is not None:
+                    self.mark_dirty(self.hud_surface.get_rect(topleft=(2, 2)))
+                self.hud_text = text
+                self.hud_surface = text_cache.get(self.font, text, self.text_color, self.text_outline)
+                self.mark_dirty(self.hud_surface.get_rect(topleft=(2, 2)))
+            self.display.blit(self.hud_surface, (2, 2))
+            if profiler:
+                profiler.lap("hud")
 
         if self.current_world is None:
             self.ending.render()
@@ -650,37 +1361,189 @@ class Main:
         self.death_screen.render()
         self.too_much_moves.render()
 
-        self.window_surf.blit(pygame.transform.scale_by(self.display, self.scale), (0, 0))
-        pygame.display.flip()
+        # overlays and fades change the whole display
+        overlay_state = (self.cur_world_id, self.death_screen.alpha > 1, self.too_much_moves.alpha > 1)
+        if any(overlay_state[1:]) or self.display_alpha < 254.5 or overlay_state != self.last_overlay_state:
+            self.full_redraw = True
+        self.last_overlay_state = overlay_state
+        if profiler:
+            profiler.lap("overlays")
+
+        self.present()
+
+    def resize(self, size):
+        """
+        fits the display into the window with the biggest integer scale, the rest of the window is letterboxed.
+        :param size: size of the window
+        :type size: Sequence[int]
+        """
+        self.window_surf = pygame.display.get_surface()
+        self.scale = max(1, min(size[0] // self.display.get_width(), size[1] // self.display.get_height()))
+        self.view_rect = pygame.Rect(0, 0, self.display.get_width() * self.scale, self.display.get_height() * self.scale)
+        self.view_rect.center = size[0] // 2, size[1] // 2
+        # preallocated, so scaling doesn't create a new surface every frame
+        self.scaled_display = pygame.Surface(self.view_rect.size, pygame.SRCALPHA)
+        self.full_redraw = True
+
+    def mark_dirty(self, rect):
+        """
+        marks a part of the display as changed, used by dirty rects mode.
+        :param rect: changed part of the display
+        :type rect: pygame.Rect
+        """
+        self.dirty.append(pygame.Rect(rect))
+
+    def present(self):
+        """scales the display into the window and shows it"""
+        profiler = self.profiler if self.profiler.enabled else None
+        if self.show_frame_times:
+            self.full_redraw = True
+        rects = []
+        if self.dirty_rects and not self.full_redraw:
+            display_rect = self.display.get_rect()
+            for rect in self.dirty:
+                rect = rect.clip(display_rect)
+                if not rect:
+                    continue
+                # merge overlapping rects, so no part is scaled twice
+                for idx in reversed(rect.collidelistall(rects)):
+                    rect.union_ip(rects.pop(idx))
+                rects.append(rect)
+        self.scaled_display.set_alpha(self.display.get_alpha())
+        if not self.dirty_rects or self.full_redraw or len(rects) > self.max_dirty_rects:
+            self.window_surf.fill(self.background_color)
+            pygame.transform.scale(self.display, self.view_rect.size, self.scaled_display)
+            self.window_surf.blit(self.scaled_display, self.view_rect)
+            if self.show_frame_times:
+                self.render_frame_times()
+            if profiler:
+                profiler.lap("scale")
+            pygame.display.flip()
+        else:
+            window_rects = []
+            for rect in rects:
+                scaled_rect = pygame.Rect(rect.x * self.scale, rect.y * self.scale, rect.w * self.scale, rect.h * self.scale)
+                window_rect = scaled_rect.move(self.view_rect.topleft)
+                self.window_surf.fill(self.background_color, window_rect)
+                pygame.transform.scale(
+                    self.display.subsurface(rect), scaled_rect.size, self.scaled_display.subsurface(scaled_rect)
+                )
+                self.window_surf.blit(self.scaled_display, window_rect, scaled_rect)
+                window_rects.append(window_rect)
+            if profiler:
+                profiler.lap("scale")
+            pygame.display.update(window_rects)
+        if profiler:
+            profiler.lap("flip")
+        self.dirty.clear()
+        self.full_redraw = False
+
+    def render_frame_times(self):
+        """draws p50 / p95 / max of every phase over the window (refreshed twice a second)"""
+        # by the time, not by self.frame (a rendered frame can run several simulation steps)
+        if self.frame_times_surface is None or pygame.time.get_ticks() - self.last_frame_times >= 500:
+            self.last_frame_times = pygame.time.get_ticks()
+            lines = ["phase      p50    p95    max [ms]"] + [
+                f"{phase:<9}{p50:>6.2f} {p95:>6.2f} {max_:>6.2f}" for phase, (p50, p95, max_) in self.profiler.stats().items()
+            ]
+            lines.append(
+                f"textures   hits {texture_cache.hits} misses {texture_cache.misses} ({texture_cache.hit_rate:.0%})"
+            )
+            lines.append(f"text       hits {text_cache.hits} misses {text_cache.misses} ({text_cache.hit_rate:.0%})")
+            self.frame_times_surface = self.frame_times_font.render(
+                "\n".join(lines), True, (255, 255, 255), (0, 0, 0, 160)
+            )
+        self.window_surf.blit(self.frame_times_surface, (4, 4))
+
+    def queue_draw(self, key, image, pos, depth=0.0):
+        """
+        queues an image to be drawn with the world outline in this frame.
+        :param key: what is drawn, a tuple which also orders the same depths (terrain, entities, player)
+        :type key: tuple
+        :param image: image, it has to stay unchanged since its outline is cached
+        :type image: pygame.Surface
+        :param pos: position of the image
+        :type pos: Sequence[int | float]
+        :param depth: isometric depth (row of the grid), deeper images are drawn first
+        :type depth: int | float
+        """
+        draw = self.draws.get(key)
+        if draw is None:
+            insort(self.draw_queue, (depth, key))
+            self.draws[key] = [depth, image, pos, self.draw_frame]
+            return
+        if draw[0] != depth:
+            del self.draw_queue[bisect_left(self.draw_queue, (draw[0], key))]
+            insort(self.draw_queue, (depth, key))
+            draw[0] = depth
+        draw[1] = image
+        draw[2] = pos
+        draw[3] = self.draw_frame
+
+    def flush_draw_queue(self):
+        """draws outlines of every queued image and then the images on top of them, from the deepest one"""
+        draws = [self.draws[key] for _, key in self.draw_queue]
+        if any(draw[3] != self.draw_frame for draw in draws):
+            # whatever wasn't queued in this frame is gone (culled, dead, another level)
+            self.draw_queue = [item for item, draw in zip(self.draw_queue, draws) if draw[3] == self.draw_frame]
+            self.draws = {key: self.draws[key] for _, key in self.draw_queue}
+            draws = [self.draws[key] for _, key in self.draw_queue]
+        self.draw_frame += 1
+        # floored once, so the outline, the image and the dirty rect land on the same pixels (also left of and above
+        # the display, where int() would round the other way than blitting)
+        draws = [(depth, image, math.floor(pos[0]), math.floor(pos[1])) for depth, image, pos, _ in draws]
+        self.display.fblits([(silhouette(image, self.world_outline_color), (x, y)) for _, image, x, y in draws])
+        self.display.fblits([(image, (x + 1, y + 1)) for _, image, x, y in draws])
+        if self.dirty_rects:
+            # everything that was drawn differently than in the last frame is dirty (both the old and the new place).
+            # the depth is a part of the key, an image moved in the drawing order covers the others differently even
+            # on the same pixels
+            drawn = {
+                (depth, image, x, y): pygame.Rect(x - 1, y - 1, image.get_width() + 4, image.get_height() + 4)
+                for depth, image, x, y in draws
+            }
+            for key in drawn.keys() ^ self.last_draws.keys():
+                self.mark_dirty(drawn[key] if key in drawn else self.last_draws[key])
+            self.last_draws = drawn
 
     def update(self):
-        if (
-            self.current_world is not None
-            and tuple(self.player.grid_pos) in self.current_world.grid[0]
-            and self.current_world.grid[0][tuple(self.player.grid_pos)][1] == "end"
-        ):
+        profiler = self.profiler if self.profiler.enabled else None
+        if profiler:
+            profiler.lap()
+        if self.current_world is not None and tuple(self.player.grid_pos) in self.current_world.board.end:
             self.dst_display_alpha = 0
+            # build the next level while the screen fades out
+            self.worlds.prefetch(self.cur_world_id + 1)
 
             if round(self.display_alpha) <= 1:
                 print("nextin")
-                self.player.grid_pos.xy = 0, 0
                 self.dst_display_alpha = 255
                 self.display_alpha = 2
                 if self.current_world.move_count <= self.current_world.max_move_count:
                     print("NEXT WORLD!")
+                    self.effects.play(audio.LEVEL_COMPLETE)
                     self.cur_world_id += 1
                 else:
                     self.too_much_moves.fade(255)
                 if self.current_world is not None:
-                    for entity in self.current_world.entities:
-                        entity.setup()
+                    self.start_world(self.player.health)
+                else:
+                    self.music.play(None)
 
         self.display_alpha = pygame.math.lerp(self.display_alpha, self.dst_display_alpha, self.dt * 4)
         self.display.set_alpha(self.display_alpha)
 
-        for event in pygame.event.get():
+        events = pygame.event.get() if self.replay is None else self.replay.get_events(self.frame)
+        if self.recorder is not None:
+            self.recorder.record_events(self.frame, events)
+        self.frame += 1
+        for event in events:
             if event.type == pygame.QUIT:
                 self.exit()
+            elif self.music.handle_event(event):
+                continue
+            elif event.type == pygame.VIDEORESIZE:
+                self.resize(event.size)
             elif event.type == pygame.KEYUP:
                 if event.key in (pygame.K_LEFT, pygame.K_UP, pygame.K_DOWN, pygame.K_RIGHT):
                     if (
@@ -690,49 +1553,105 @@ class Main:
                         or self.too_much_moves.alpha >= 1
                     ):
                         continue
-                    move = {pygame.K_LEFT: (-1, 1), pygame.K_RIGHT: (1, -1), pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
-                    if tuple(self.player.grid_pos + move[event.key]) not in self.current_world.grid[0]:
+                    move = {
+                        pygame.K_LEFT: engine.LEFT,
+                        pygame.K_RIGHT: engine.RIGHT,
+                        pygame.K_UP: engine.UP,
+                        pygame.K_DOWN: engine.DOWN,
+                    }
+                    health = self.player.health
+                    if not self.current_world.step(move[event.key]):
                         continue
                     self.player.ready_for_next_move = False
-                    self.player.grid_pos += move[event.key]
-                    self.player.last_move = move[event.key]
-                    self.current_world.move_count += 1
-                    for entity in self.current_world.entities:
-                        entity.update()
+                    self.rng = self.current_world.state.rng
+                    if self.player.health <= 0:
+                        self.effects.play(audio.DEATH)
+                    elif self.player.health < health:
+                        self.effects.play(audio.HIT)
+                    else:
+                        self.effects.play(audio.MOVE)
                 elif event.key == pygame.K_r:
                     if self.current_world is None:
                         continue
                     self.death_screen.fade(0)
                     self.too_much_moves.fade(0)
-                    self.current_world.move_count = 0
-                    self.player.grid_pos.xy = 0, 0
-                    self.player.health = self.player.max_health
-                    for entity in self.current_world.entities:
-                        entity.setup()
+                    self.start_world()
+                elif event.key == Config.TOGGLE_FRAME_TIMES:
+                    self.show_frame_times = not self.show_frame_times
+                    self.profiler.enabled = self.show_frame_times or self.frame_times_path is not None
         self.player.update()
+        if self.current_world is not None:
+            for entity in self.current_world.entities:
+                entity.move()
+        self.death_screen.update()
+        self.too_much_moves.update()
+        if profiler:
+            profiler.lap("update")
 
     def exit(self):
+        if self.recorder is not None:
+            self.recorder.save()
+        if self.frame_times_path is not None:
+            self.profiler.export(self.frame_times_path)
         pygame.quit()
         exit()
 
+    def advance(self):
+        """runs the simulation steps due since the last frame and renders the frame"""
+        for _ in range(self.scheduler.advance()):
+            self.update()
+        self.render()
+
+    def tick(self):
+        """sleeps for the rest of the frame budget"""
+        if self.profiler.enabled:
+            self.profiler.lap()
+        time.sleep(self.scheduler.remaining())
+        self.end_frame()
+
+    async def async_tick(self):
+        """sleeps for the rest of the frame budget, without blocking the event loop (browser)"""
+        if self.profiler.enabled:
+            self.profiler.lap()
+        await asyncio.sleep(self.scheduler.remaining())
+        self.end_frame()
+
+    def end_frame(self):
+        self.clock.tick()
+        # the caption is updated once a second, formatting it every frame is a waste
+        if pygame.time.get_ticks() - self.last_caption >= 1000:
+            self.last_caption = pygame.time.get_ticks()
+            pygame.display.set_caption(f'{self.title.split("|")[0]}| {self.clock.get_fps():.1f}')
+        if self.profiler.enabled:
+            self.profiler.lap("tick")
+            self.profiler.end_frame()
+
     def run(self):
+        if not self.loaded:
+            self.load()
         while True:
-            self.render()
-            self.update()
-            self.dt = self.clock.tick(self.FPS) / 1000
-            pygame.display.set_caption(f'{self.title.split("|")[0]}| {self.clock.get_fps()}')
+            self.advance()
+            self.tick()
 
     async def async_run(self):
+        if not self.loaded:
+            await self.async_load()
         while True:
-            self.render()
-            self.update()
-            self.dt = self.clock.tick(self.FPS) / 1000
-            pygame.display.set_caption(f'{self.title.split("|")[0]}| {self.clock.get_fps()}')
-            await asyncio.sleep(0)
+            self.advance()
+            await self.async_tick()
 
 
 if __name__ == "__main__":
     if "WorldD" in argv:
         WorldD.Main().run()
     else:
-        asyncio.run(Main().async_run())
+        asyncio.run(
+            Main(
+                argv[argv.index("--pack") + 1] if "--pack" in argv else None,
+                "--dirty-rects" in argv,
+                record=argv[argv.index("--record") + 1] if "--record" in argv else None,
+                frame_times=argv[argv.index("--frame-times") + 1] if "--frame-times" in argv else None,
+                max_fps=int(argv[argv.index("--fps") + 1]) if "--fps" in argv else 60,
+                load=False,
+            ).async_run()
+        )
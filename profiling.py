@@ -0,0 +1,203 @@
+"""
+profiling of the game or the editor (WorldD).
+
+the target runs for a fixed amount of frames or plays a recording (see replay.py). there are two modes:
+    deterministic   cProfile, writes <output>.pstats and <output>.collapsed (stacks rebuilt from the call graph)
+    sampling        a thread records the stack of the main thread every --interval ms, writes <output>.collapsed.
+                    it barely slows the game down, so the hot paths aren't skewed by the profiler itself
+
+.collapsed files are "frame;frame;frame count" lines, flamegraph.pl, speedscope or inferno can read them.
+
+usage: python profiling.py {game,editor} [--frames N | --replay PATH] [--sampling] [--interval MS]
+                           [--output PREFIX] [--headless] [--world PATH]
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler(threading.Thread):
+    """records the stack of a thread every interval, the counts of the stacks are in self.stacks"""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        """
+        :param interval: time between two samples [ s ]
+        :param thread_id: sampled thread, if None then the thread creating the sampler
+        """
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = Counter()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            del frame
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+def collapse_stats(stats: pstats.Stats, max_depth=64) -> Counter:
+    """
+    cProfile only keeps caller -> callee pairs, so the stacks are rebuilt from the roots down and the time of a function
+    is split between its callers by how much of it every caller caused.
+    :return: stack -> own time [ us ]
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            children.setdefault(caller, []).append((func, cumulative))
+    stacks = Counter()
+
+    def walk(func, stack, visited, share):
+        own = stats.stats[func][2]
+        stack = stack + (f"{func[2]} ({os.path.basename(func[0])}:{func[1]})",)
+        # recursion is cut at the first repeat, its time stays in the outer call
+        visited = visited | {func}
+        if own * share * 1e6 >= 1:
+            stacks[";".join(stack)] += round(own * share * 1e6)
+        if len(stack) >= max_depth:
+            return
+        for callee, callee_cumulative in children.get(func, ()):
+            callee_share = share * callee_cumulative / stats.stats[callee][3] if stats.stats[callee][3] else 0
+            if callee_share * stats.stats[callee][3] * 1e6 >= 1 and callee not in visited:
+                walk(callee, stack, visited, callee_share)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(func, (), frozenset(), 1)
+    return stacks
+
+
+def write_collapsed(path, stacks: Counter):
+    with open(path, "w") as file:
+        file.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def game_frames(frames, level_pack=None):
+    """
+    :return: function running the game for the amount of frames, one simulation step per frame and without the frame
+             cap (the sleep of tick() would take most of the profile)
+    """
+    import main
+
+    game = main.Main(level_pack, max_fps=0)
+
+    def run():
+        for _ in range(frames):
+            game.update()
+            game.render()
+            game.end_frame()
+
+    return run
+
+
+def editor_frames(frames, world=None):
+    """:return: function running the editor for the amount of frames, without the frame cap"""
+    import WorldD_r.main as WorldD
+
+    editor = WorldD.Main()
+    if world is not None:
+        editor.projects.append(WorldD.Project(editor, (32, 32), load=world))
+        editor.selected = len(editor.projects) - 1
+
+    def run():
+        for _ in range(frames):
+            editor.refresh()
+            WorldD.pg.display.flip()
+            editor.clock.tick()
+            editor.eventHandler()
+
+    return run
+
+
+def profile(run, output="profile", sampling=False, interval=0.005):
+    """
+    :param run: profiled function
+    :param output: prefix of the written files
+    :param sampling: use the sampling profiler instead of cProfile
+    :param interval: time between two samples [ s ]
+    :return: paths of the written files
+    """
+    if sampling:
+        sampler = Sampler(interval)
+        sampler.start()
+        try:
+            run()
+        except SystemExit:
+            pass
+        finally:
+            sampler.stop()
+        write_collapsed(f"{output}.collapsed", sampler.stacks)
+        return [f"{output}.collapsed"]
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        run()
+    except SystemExit:
+        pass
+    finally:
+        profiler.disable()
+    profiler.dump_stats(f"{output}.pstats")
+    stats = pstats.Stats(profiler)
+    write_collapsed(f"{output}.collapsed", collapse_stats(stats))
+    stats.sort_stats("tottime").print_stats(20)
+    return [f"{output}.pstats", f"{output}.collapsed"]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="profiles the game or the editor")
+    parser.add_argument("target", choices=("game", "editor"))
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--frames", type=int, default=600, help="amount of profiled frames")
+    source.add_argument("--replay", default=None, help="play a recording instead (game only)")
+    parser.add_argument("--sampling", action="store_true", help="sample stacks instead of cProfile")
+    parser.add_argument("--interval", type=float, default=5, help="time between two samples [ ms ]")
+    parser.add_argument("--output", default=None, help="prefix of the written files (default: the target)")
+    parser.add_argument("--headless", action="store_true", help="run without a window and without sound")
+    parser.add_argument("--pack", default=None, help="level pack of the game")
+    parser.add_argument("--world", default=None, help="world opened in the editor")
+    args = parser.parse_args(args)
+
+    if args.headless or args.replay is not None:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    if args.replay is not None:
+        if args.target != "game":
+            parser.error("--replay is only supported for the game")
+        import replay
+
+        def run():
+            print(replay.play(args.replay))
+
+    elif args.target == "game":
+        run = game_frames(args.frames, args.pack)
+    else:
+        run = editor_frames(args.frames, args.world)
+
+    for path in profile(run, args.output or args.target, args.sampling, args.interval / 1000):
+        print(f"written {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+input recording and headless replays.
+
+a recording holds the seed of the storms, the key events with the index of the simulation step they came in and the
+length of the step (see scheduler.py). feeding it back through Main gives the same game, step by step, so replays
+reproduce bugs and make workloads for performance tests.
+
+record: python main.py --record session.replay
+replay: python replay.py session.replay
+"""
+import atexit
+import json
+import os
+import time
+from sys import argv
+
+FORMAT_VERSION = 1
+# only these events change the game
+EVENT_TYPES = ("KEYDOWN", "KEYUP", "QUIT")
+
+
+class Recorder:
+    def __init__(self, path, seed, level_pack=None, step=1 / 60):
+        """
+        :param path: where the recording is saved (when the game exits)
+        :param seed: seed of the storms
+        :param level_pack: path to the level pack the game runs, if any
+        :param step: length of a simulation step [ s ]
+        """
+        import pygame
+
+        self.path = path
+        self.seed = seed
+        self.level_pack = level_pack
+        self.types = {getattr(pygame, name): name for name in EVENT_TYPES}
+        self.step = step
+        self.events = []
+        self.frames = 0
+        self.saved = False
+        atexit.register(self.save)
+
+    def record_events(self, frame, events):
+        self.frames = frame + 1
+        for event in events:
+            if event.type in self.types:
+                self.events.append((frame, self.types[event.type], getattr(event, "key", 0)))
+
+    def save(self):
+        if self.saved:
+            return
+        self.saved = True
+        with open(self.path, "w") as file:
+            json.dump(
+                {
+                    "version": FORMAT_VERSION,
+                    "seed": self.seed,
+                    "pack": self.level_pack,
+                    "frames": self.frames,
+                    "step": self.step,
+                    "events": self.events,
+                },
+                file,
+            )
+
+
+class Replay:
+    def __init__(self, path):
+        import pygame
+
+        with open(path) as file:
+            data = json.load(file)
+        if data["version"] != FORMAT_VERSION:
+            raise ValueError(f"unsupported replay version {data['version']} (expected {FORMAT_VERSION})")
+        self.seed = data["seed"]
+        self.level_pack = data["pack"]
+        self.frames = data["frames"]
+        self.step = data["step"]
+        self.events: dict[int, list] = {}
+        for frame, event_type, key in data["events"]:
+            # quitting ends the replay, it doesn't close the replaying process
+            if event_type != "QUIT":
+                self.events.setdefault(frame, []).append(pygame.event.Event(getattr(pygame, event_type), key=key))
+
+    def get_events(self, frame):
+        """:return: events which came in the frame"""
+        return self.events.get(frame, ())
+
+
+def play(path, game_class=None):
+    """
+    plays a recording as fast as possible (not limited by the FPS), without a real window.
+    :param path: path to the recording
+    :param game_class: class of the game, if None then main.Main
+    :return: summary of the replay
+    :rtype: dict
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import main
+
+    replay = Replay(path)
+    game = (game_class or main.Main)(replay.level_pack, seed=replay.seed)
+    game.replay = replay
+    game.dt = replay.step
+    started = time.perf_counter()
+    for frame in range(replay.frames):
+        game.render()
+        game.update()
+    seconds = time.perf_counter() - started
+    world = game.current_world
+    return {
+        "frames": replay.frames,
+        "seconds": seconds,
+        "fps": replay.frames / seconds if seconds else 0.0,
+        "level": game.cur_world_id,
+        "health": game.player.health,
+        "move_count": None if world is None else world.move_count,
+    }
+
+
+if __name__ == "__main__":
+    if len(argv) < 2:
+        print("usage: python replay.py <recording>")
+    else:
+        print(json.dumps(play(argv[1]), indent=2))
@@ -0,0 +1,53 @@
+"""
+frame scheduler with a fixed simulation step.
+
+the game is simulated in steps of the same length no matter the refresh rate, so it plays the same at 30, 60 or 144 Hz.
+every frame runs the steps which are due and renders in between the last two steps (alpha), the rest of the frame
+budget is slept (time.sleep or asyncio.sleep in the browser) instead of spinning.
+"""
+from time import perf_counter
+
+
+class FixedStep:
+    def __init__(self, step=1 / 60, max_fps=60, max_steps=5):
+        """
+        :param step: length of a simulation step [ s ]
+        :param max_fps: frame cap, 0 or None for no cap
+        :param max_steps: most steps run in one frame, the time over it is dropped (the game slows down instead of
+                          freezing when a frame takes too long)
+        """
+        self.step = step
+        self.max_fps = max_fps
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        # progress from the last step to the next one, 1 until the scheduler runs (headless runs render the last step)
+        self.alpha = 1.0
+        self.last = None
+        self.next_frame = None
+
+    def advance(self):
+        """:return: amount of simulation steps due since the last call"""
+        now = perf_counter()
+        if self.last is not None:
+            self.accumulator += now - self.last
+        self.last = now
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.step
+        self.alpha = self.accumulator / self.step
+        return steps
+
+    def remaining(self):
+        """:return: time left of the frame budget [ s ], 0 without a frame cap"""
+        if not self.max_fps:
+            return 0.0
+        budget = 1 / self.max_fps
+        now = perf_counter()
+        # frames are scheduled from the previous deadline, so the sleep doesn't drift, unless the game fell behind
+        if self.next_frame is None or now - self.next_frame > budget:
+            self.next_frame = now
+        self.next_frame += budget
+        return max(self.next_frame - now, 0.0)
@@ -0,0 +1,193 @@
+"""
+level solver, proves that every level can be beaten within its max move count.
+
+it runs a breadth-first search over the states of the headless engine (engine.py), so the first solution found is
+the shortest one. states already seen are kept in a transposition table, which also stores how they were reached.
+levels are solved in parallel on a process pool, workers only need the engine, not pygame.
+
+storm knockbacks are random, so "beatable" only holds for the seed and the starting health the levels were solved
+with. the game picks a random seed and carries the health over from the previous level, a level beatable with seed 0
+at full health may need a storm hit (or be impossible) with another seed or less health.
+
+usage: python solver.py [--seed N] [--health N] [--processes N] [--pack PATH] [--json]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+
+import engine
+
+MOVE_NAMES = {engine.LEFT: "left", engine.RIGHT: "right", engine.UP: "up", engine.DOWN: "down"}
+
+
+@dataclass(frozen=True)
+class Solution:
+    level: int
+    seed: int
+    health: int
+    # shortest list of moves finishing the level, None if there is none within max_depth
+    moves: tuple[str, ...] | None
+    max_move_count: int
+    nodes: int
+    seconds: float
+    peak_memory: int
+
+    @property
+    def beatable(self) -> bool:
+        return self.moves is not None and len(self.moves) <= self.max_move_count
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+
+def state_key(state: engine.State):
+    """
+    part of the state which matters for the next turns.
+    the move count is the depth of the search and the rest (last move, last cell, can attack) is set again every turn.
+    """
+    return state.player, state.health, tuple((entity.cell, entity.direction) for entity in state.entities), state.rng
+
+
+def search(board: engine.Board, seed: int = 0, max_depth: int | None = None, health: int | None = None):
+    """
+    :param board: board of the level
+    :param seed: seed of the storms (same as Main(seed=...))
+    :param max_depth: how many moves are searched, if None then the max move count of the board
+    :param health: health of the player at the start, if None then the max health of the board
+    :return: shortest list of moves (None if there is none), amount of searched nodes
+    """
+    max_depth = board.max_move_count if max_depth is None else max_depth
+    start = engine.start(board, seed, health)
+    # transposition table: state key -> (key of the previous state, move)
+    parents = {state_key(start): None}
+    frontier = [start]
+    goal = state_key(start) if engine.is_finished(board, start) else None
+    nodes = 0
+    depth = 0
+    while frontier and goal is None and depth < max_depth:
+        depth += 1
+        next_frontier = []
+        for state in frontier:
+            nodes += 1
+            key = state_key(state)
+            for move in engine.MOVES:
+                new_state = engine.step(board, state, move)
+                if new_state is state or engine.is_dead(new_state):
+                    continue
+                new_key = state_key(new_state)
+                if new_key in parents:
+                    continue
+                parents[new_key] = (key, move)
+                if engine.is_finished(board, new_state):
+                    goal = new_key
+                    break
+                next_frontier.append(new_state)
+            if goal is not None:
+                break
+        frontier = next_frontier
+
+    if goal is None:
+        return None, nodes
+    moves = []
+    while parents[goal] is not None:
+        goal, move = parents[goal]
+        moves.append(MOVE_NAMES[move])
+    return tuple(reversed(moves)), nodes
+
+
+def solve(
+    board: engine.Board, seed: int = 0, max_depth: int | None = None, level: int = 0, health: int | None = None
+) -> Solution:
+    """
+    the search runs twice, the time is measured without tracemalloc (it slows the search down about 10x) and the peak
+    memory in a second run.
+    :param board: board of the level
+    :param seed: seed of the storms (same as Main(seed=...))
+    :param max_depth: how many moves are searched, if None then the max move count of the board
+    :param level: index of the level, only reported back in the solution
+    :param health: health of the player at the start, if None then the max health of the board
+    :return: shortest solution
+    """
+    health = board.max_health if health is None else health
+    started = time.perf_counter()
+    moves, nodes = search(board, seed, max_depth, health)
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    search(board, seed, max_depth, health)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Solution(level, seed, health, moves, board.max_move_count, nodes, seconds, peak_memory)
+
+
+def _solve(args):
+    return solve(*args)
+
+
+def solve_all(boards, seed: int = 0, processes: int | None = None, health: int | None = None) -> list[Solution]:
+    """
+    :param boards: boards of the levels
+    :param seed: seed of the storms
+    :param processes: size of the process pool, if None then the number of cpus
+    :param health: health of the player at the start of every level, if None then the max health of the board
+    :return: solutions in the order of the boards
+    """
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(_solve, [(board, seed, None, idx, health) for idx, board in enumerate(boards)]))
+
+
+def load_boards(pack=None) -> list[engine.Board]:
+    """
+    :param pack: path to a level pack, if None then the levels defined in main.py
+    :return: boards of every level
+    """
+    import main
+
+    if pack is None:
+        levels = main.LEVELS
+    else:
+        level_pack = main.levelpack.LevelPack(pack)
+        levels = [main.PackedLevel(level_pack, idx) for idx in range(len(level_pack))]
+    return [level.board() for level in levels]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="proves every level is beatable within its max move count")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the storms")
+    parser.add_argument("--health", type=int, default=None, help="health at the start of every level (default: max)")
+    parser.add_argument("--processes", type=int, default=None, help="size of the process pool")
+    parser.add_argument("--pack", default=None, help="solve levels from a level pack")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    solutions = solve_all(load_boards(args.pack), args.seed, args.processes, args.health)
+    total = time.perf_counter() - started
+    if args.json:
+        print(
+            json.dumps(
+                [
+                    {**asdict(solution), "beatable": solution.beatable, "nodes_per_second": solution.nodes_per_second}
+                    for solution in solutions
+                ],
+                indent=2,
+            )
+        )
+    else:
+        for solution in solutions:
+            moves = "-" if solution.moves is None else len(solution.moves)
+            print(
+                f"level {solution.level + 1:>3}: {'OK  ' if solution.beatable else 'FAIL'} "
+                f"optimal {moves:>3} / {solution.max_move_count:<3} "
+                f"{solution.nodes:>8} nodes {solution.nodes_per_second:>10.0f} nodes/s "
+                f"peak {solution.peak_memory / 1024:>8.1f} KiB  {' '.join(solution.moves or ())}"
+            )
+        health = "max" if args.health is None else args.health
+        print(
+            f"{sum(solution.beatable for solution in solutions)}/{len(solutions)} beatable "
+            f"with seed {args.seed} and {health} health in {total:.2f}s"
+        )